@@ -0,0 +1,32 @@
+import os
+import argparse
+
+from modules.brat_conversion import convert_corpus, directories
+
+# Convert BRAT-tool annotated files to "goldstandard" .json files in parallel.
+# Run from the experiments directory, e.g.:
+#   python convert_brat_to_json.py --workers 16
+# Only protocols whose .txt or .ann file (or the conversion settings) changed since
+# the last run are converted again, so a killed run can be started again with the
+# same command. The hashes are kept in the manifest next to the output directory.
+def main():
+    parser = argparse.ArgumentParser(description='Convert BRAT-tool annotated files to "goldstandard" .json files')
+    parser.add_argument('--source', default=os.path.join('..', 'data', 'vallakohtufailid'),
+                        help='location of the directories with the .txt and .ann files')
+    parser.add_argument('--target', default=os.path.join('..', 'data', 'vallakohtufailid-json-flattened'),
+                        help='location where the .json files will be saved to')
+    parser.add_argument('--directories', nargs='+', default=directories,
+                        help='directories (in the source location) to convert')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (1 converts the files in this process)')
+    parser.add_argument('--chunk-size', type=int, default=4,
+                        help='number of files given to a worker at once')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the manifest and convert all files again')
+    args = parser.parse_args()
+
+    convert_corpus(args.source, args.directories, args.target,
+                   workers=args.workers, chunk_size=args.chunk_size, restart=args.restart)
+
+if __name__ == '__main__':
+    main()
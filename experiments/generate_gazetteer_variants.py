@@ -0,0 +1,43 @@
+import os
+import argparse
+
+from models.gazetteer_index import read_gazetteer, get_gazetteer_index
+from models.gazetteer_variants import canonical_gazetteer, variant_groups, write_gazetteer
+
+# Normalise the phrases of a gazetteer file to canonical keys (see models.gazetteer_variants),
+# so that the spelling variants of the old and new orthography are found with one lookup.
+# Run from the experiments directory, e.g.:
+#   python generate_gazetteer_variants.py --gazetteer models/gazetteer_both_lowercase_added_loc.txt
+# The canonical gazetteer is written next to the gazetteer file (with the suffix _canonical) and
+# compiled into an index. To use the canonical keys in a model, set GAZETTEER_LOOKUP = 'canonical'
+# in its settings.py (the GAZETTEER_FILE can be the original or the canonical gazetteer).
+def main():
+    parser = argparse.ArgumentParser(description='Normalise the phrases of a gazetteer to canonical keys')
+    parser.add_argument('--gazetteer', default=os.path.join('models', 'gazetteer_both_lowercase_added_loc.txt'),
+                        help='the gazetteer file (a phrase and its label separated by a tab on each line)')
+    parser.add_argument('--output', default=None,
+                        help='the canonical gazetteer file (by default next to the gazetteer file)')
+    parser.add_argument('--show-variants', action='store_true',
+                        help='print the phrases that have the same canonical key')
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None:
+        root, extension = os.path.splitext(args.gazetteer)
+        output = root + '_canonical' + extension
+
+    data = read_gazetteer(args.gazetteer)
+    groups = variant_groups(data)
+    write_gazetteer(canonical_gazetteer(data), output)
+    get_gazetteer_index(output, canonical=True)
+
+    print(f'{len(data)} phrases, {len(groups)} canonical keys, '
+          f'{sum(len(phrases) > 1 for phrases in groups.values())} keys with several spellings')
+    if args.show_variants:
+        for key in sorted(groups):
+            if len(groups[key]) > 1:
+                print(key, '\t', ', '.join(sorted(groups[key])))
+    print(f'Saved the canonical gazetteer to {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import codecs
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from models.gazetteer_variants import canonical_gazetteer
+
+# A compiled gazetteer is a binary file next to the gazetteer file (gazetteer file + index_suffix)
+# that holds a token trie of the phrases (see build_trie), with the nodes numbered in the order
+# of a depth-first walk:
+#   header: magic, size and mtime of the gazetteer file, number of labels, phrases, nodes, edges
+#     and parts (the distinct space-separated parts of the phrases)
+#   labels: the label names (UTF-8, separated by newlines), preceded by their length in bytes
+#   part offsets: number of parts + 1 unsigned ints, the start of each part in the string table
+#   edges: number of nodes + 1 unsigned ints, the first edge of each node (the edges of node k
+#     are edges[k]..edges[k + 1] - 1)
+#   edge parts: number of edges unsigned ints, the part of each edge (in increasing order for
+#     the edges of a node)
+#   edge targets: number of edges unsigned ints, the node each edge leads to
+#   masks: number of nodes unsigned ints, the labels of the phrase ending at each node as a
+#     bitmask (0 if no phrase ends there)
+#   string table: the UTF-8 encoded parts in sorted order
+# The ints are in the byte order of the machine, the index is a cache and not meant to be shared.
+index_suffix = '.index'
+canonical_index_suffix = '.canonical.index'
+index_magic = b'GAZIDX02'
+header_format = '=8sQdIIIII'
+max_labels = 32
+
+indexes = dict()
+
+# Read a gazetteer file (a phrase and its label separated by a tab on each line)
+# Output: a dictionary {phrase: set of labels}
+def read_gazetteer(gazetteer_file):
+    data = defaultdict(set)
+    with codecs.open(gazetteer_file, 'rb', encoding="utf8") as f:
+        for ln in f:
+            word, lbl = ln.strip().rsplit("\t", 1)
+            data[word].add(lbl)
+    return data
+
+# Build a token trie of the phrases of a gazetteer by their space-separated parts
+# Output: the root node; each node is a dictionary of child nodes, None marks the labels of a
+#   phrase ending there
+def build_trie(data):
+    root = dict()
+    for phrase, labels in data.items():
+        node = root
+        for part in phrase.split(' '):
+            node = node.setdefault(part, dict())
+        node[None] = labels
+    return root
+
+# Compile a gazetteer (a dictionary {phrase: set of labels}, see read_gazetteer) into an index
+# gazetteer_stat: os.stat of the gazetteer file, recorded for checking whether the index is up to date
+# Output: the index as bytes
+def compile_gazetteer(data, gazetteer_stat=None):
+    labels = sorted({label for phrase_labels in data.values() for label in phrase_labels})
+    if len(labels) > max_labels:
+        raise ValueError('a gazetteer index can have at most {} labels, got {}'.format(max_labels, len(labels)))
+    label_bits = {label: 1 << i for i, label in enumerate(labels)}
+
+    parts = sorted({part.encode('utf8') for phrase in data for part in phrase.split(' ')})
+    part_ids = {part.decode('utf8'): i for i, part in enumerate(parts)}
+    part_offsets = array('I', [0])
+    for part in parts:
+        part_offsets.append(part_offsets[-1] + len(part))
+
+    edges = array('I')
+    edge_parts = array('I')
+    edge_targets = array('I')
+    masks = array('I')
+    # Number the nodes depth-first; the edges of a node are written when the node is visited,
+    # and the targets are filled in when the child nodes get their numbers
+    stack = [(build_trie(data), None)]
+    while stack:
+        node, parent_edge = stack.pop()
+        if parent_edge is not None:
+            edge_targets[parent_edge] = len(masks)
+        mask = 0
+        for label in node.get(None, ()):
+            mask |= label_bits[label]
+        masks.append(mask)
+        edges.append(len(edge_parts))
+        children = sorted((part_ids[part], child) for part, child in node.items() if part is not None)
+        first_edge = len(edge_parts)
+        for part_id, child in children:
+            edge_parts.append(part_id)
+            edge_targets.append(0)
+        stack.extend((child, first_edge + k) for k, (part_id, child) in reversed(list(enumerate(children))))
+    edges.append(len(edge_parts))
+
+    size, mtime = (gazetteer_stat.st_size, gazetteer_stat.st_mtime) if gazetteer_stat is not None else (0, 0.0)
+    label_bytes = '\n'.join(labels).encode('utf8')
+    return b''.join([struct.pack(header_format, index_magic, size, mtime, len(labels), len(data),
+                                 len(masks), len(edge_parts), len(parts)),
+                     struct.pack('=I', len(label_bytes)), label_bytes,
+                     part_offsets.tobytes(), edges.tobytes(), edge_parts.tobytes(), edge_targets.tobytes(),
+                     masks.tobytes()] + parts)
+
+# Return True if the index (bytes or mmap) was compiled from the gazetteer file with the given os.stat
+def is_up_to_date(buffer, gazetteer_stat):
+    if len(buffer) < struct.calcsize(header_format):
+        return False
+    magic, size, mtime = struct.unpack_from(header_format, buffer)[:3]
+    return magic == index_magic and size == gazetteer_stat.st_size and mtime == gazetteer_stat.st_mtime
+
+
+class PartTable:
+    """The sorted parts of a GazetteerIndex as a sequence of bytes (for bisect)."""
+
+    def __init__(self, offsets, strings):
+        self.offsets = offsets
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.strings[self.offsets[i]:self.offsets[i + 1]])
+
+
+class GazetteerIndex:
+    """A read-only gazetteer over a compiled index (see compile_gazetteer). The phrases are
+    found by walking down the token trie of the index part by part, which is read in place:
+    when the index is memory-mapped, the processes that use the same index file share its
+    pages. It can be used like the dictionary {phrase: set of labels} returned by read_gazetteer.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        view = memoryview(buffer)
+        position = struct.calcsize(header_format)
+        magic, size, mtime, n_labels, n_phrases, n_nodes, n_edges, n_parts = struct.unpack_from(header_format, view)
+        if magic != index_magic:
+            raise ValueError('not a gazetteer index')
+        self.n_phrases = n_phrases
+        label_size, = struct.unpack_from('=I', view, position)
+        position += 4
+        self.labels = view[position:position + label_size].tobytes().decode('utf8').split('\n') if n_labels else []
+        position += label_size
+        part_offsets = view[position:position + 4 * (n_parts + 1)].cast('I')
+        position += 4 * (n_parts + 1)
+        self.edges = view[position:position + 4 * (n_nodes + 1)].cast('I')
+        position += 4 * (n_nodes + 1)
+        self.edge_parts = view[position:position + 4 * n_edges].cast('I')
+        position += 4 * n_edges
+        self.edge_targets = view[position:position + 4 * n_edges].cast('I')
+        position += 4 * n_edges
+        self.masks = view[position:position + 4 * n_nodes].cast('I')
+        position += 4 * n_nodes
+        self.parts = PartTable(part_offsets, view[position:])
+        # Phrases with the same labels share the same set
+        self.label_sets = dict()
+
+    def __len__(self):
+        return self.n_phrases
+
+    def _labels(self, mask):
+        labels = self.label_sets.get(mask)
+        if labels is None:
+            labels = {label for i, label in enumerate(self.labels) if mask & (1 << i)}
+            self.label_sets[mask] = labels
+        return labels
+
+    # Return the number of a part (str) or -1 if no phrase has it
+    def _part_id(self, part):
+        part = part.encode('utf8')
+        i = bisect_left(self.parts, part)
+        if i < len(self.parts) and self.parts[i] == part:
+            return i
+        return -1
+
+    # Return the node reached from the node by the edge of the part (number) or -1
+    def _child(self, node, part_id):
+        lo, hi = self.edges[node], self.edges[node + 1]
+        i = bisect_left(self.edge_parts, part_id, lo, hi)
+        if i < hi and self.edge_parts[i] == part_id:
+            return self.edge_targets[i]
+        return -1
+
+    # Return the node reached from the node by the parts (numbers) or -1
+    def _walk(self, node, part_ids):
+        for part_id in part_ids:
+            if part_id < 0:
+                return -1
+            node = self._child(node, part_id)
+            if node < 0:
+                return -1
+        return node
+
+    # Return the node of the phrase or -1
+    def _find(self, phrase):
+        return self._walk(0, [self._part_id(part) for part in phrase.split(' ')])
+
+    def __contains__(self, phrase):
+        node = self._find(phrase)
+        return node >= 0 and self.masks[node] != 0
+
+    def __getitem__(self, phrase):
+        node = self._find(phrase)
+        if node < 0 or self.masks[node] == 0:
+            raise KeyError(phrase)
+        return self._labels(self.masks[node])
+
+    def get(self, phrase, default=None):
+        node = self._find(phrase)
+        return self._labels(self.masks[node]) if node >= 0 and self.masks[node] != 0 else default
+
+    # Find the gazetteer phrases in a sequence of (lowercased) tokens in one pass: the trie is
+    # walked down from each token at which a phrase may start, token by token, until no phrase
+    # continues with the next token (a token may contain spaces, as may the phrases)
+    # starts: an optional list of booleans, the tokens at which phrases may start
+    # look_ahead: the maximum number of tokens in a phrase (None for no limit)
+    # Output: a generator of tuples (first token, last token + 1, labels) ordered by the
+    #   first token and then by the length of the phrase
+    def matches(self, keys, starts=None, look_ahead=None):
+        n = len(keys)
+        # The parts of each token are looked up once, even if the token is in several phrases
+        key_parts = [None] * n
+        for i in range(n):
+            if starts is not None and not starts[i]:
+                continue
+            end = n if look_ahead is None else min(n, i + look_ahead)
+            node = 0
+            for j in range(i, end):
+                if key_parts[j] is None:
+                    key_parts[j] = [self._part_id(part) for part in keys[j].split(' ')]
+                node = self._walk(node, key_parts[j])
+                if node < 0:
+                    break
+                if self.masks[node]:
+                    yield i, j + 1, self._labels(self.masks[node])
+
+# Return the index of the gazetteer file, compiling it if the index file is missing or out of date.
+# The index file is memory-mapped; if it cannot be written, the index is kept in memory.
+# canonical: index the canonical keys of the phrases (see models.gazetteer_variants)
+def load_gazetteer_index(gazetteer_file, canonical=False):
+    gazetteer_stat = os.stat(gazetteer_file)
+    index_file = gazetteer_file + (canonical_index_suffix if canonical else index_suffix)
+    if os.path.exists(index_file) and os.path.getsize(index_file) > 0:
+        with open(index_file, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if is_up_to_date(buffer, gazetteer_stat):
+            return GazetteerIndex(buffer)
+        buffer.close()
+
+    data = read_gazetteer(gazetteer_file)
+    if canonical:
+        data = canonical_gazetteer(data)
+    compiled = compile_gazetteer(data, gazetteer_stat)
+    try:
+        temporary_file = '{}.{}.tmp'.format(index_file, os.getpid())
+        with open(temporary_file, 'wb') as f:
+            f.write(compiled)
+        os.replace(temporary_file, index_file)
+    except OSError:
+        return GazetteerIndex(compiled)
+    with open(index_file, 'rb') as f:
+        return GazetteerIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+# Return the index of the gazetteer file (see load_gazetteer_index). The indexes are kept by the
+# path and mtime of the gazetteer file, so all taggers of a process (and the workers forked after
+# the index is loaded) use the same index, and a changed gazetteer file is compiled again.
+def get_gazetteer_index(gazetteer_file, canonical=False):
+    key = (os.path.abspath(gazetteer_file), os.path.getmtime(gazetteer_file), canonical)
+    if key not in indexes:
+        indexes[key] = load_gazetteer_index(gazetteer_file, canonical)
+    return indexes[key]
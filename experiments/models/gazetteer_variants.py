@@ -0,0 +1,39 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+# Spelling differences between the old and the new orthography in the protocols, e.g.
+# "Jögewa" / "Jõgeva", "Tomas" / "Toomas", "Wanemuise" / "Vanemuise"
+letter_variants = str.maketrans({'w': 'v', 'ö': 'õ'})
+double_vowel_pattern = re.compile(r'([aeiouõäöü])\1+')
+
+# Return the canonical key of a phrase: the phrase in lowercase, with 'w' written as 'v',
+# 'ö' as 'õ' and the double vowels as single ones. The spelling variants of a name
+# have the same canonical key, so one lookup finds all of them.
+@lru_cache(maxsize=200000)
+def canonical_key(phrase):
+    return double_vowel_pattern.sub(r'\1', phrase.lower().translate(letter_variants))
+
+# Group the phrases of a gazetteer (a dictionary {phrase: set of labels}) by their canonical keys
+# Output: a dictionary {canonical key: set of phrases}
+def variant_groups(data):
+    groups = defaultdict(set)
+    for phrase in data:
+        groups[canonical_key(phrase)].add(phrase)
+    return groups
+
+# Return the gazetteer with the phrases replaced by their canonical keys: the labels of
+# the spelling variants of a phrase are joined
+# Output: a dictionary {canonical key: set of labels}
+def canonical_gazetteer(data):
+    canonical = defaultdict(set)
+    for phrase, labels in data.items():
+        canonical[canonical_key(phrase)] |= labels
+    return canonical
+
+# Write a gazetteer (a dictionary {phrase: set of labels}) in the format of the gazetteer files
+def write_gazetteer(data, gazetteer_file):
+    with open(gazetteer_file, 'w', encoding='utf8') as f:
+        for phrase in sorted(data):
+            for label in sorted(data[phrase]):
+                f.write('{}\t{}\n'.format(phrase, label))
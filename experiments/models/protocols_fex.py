@@ -4,6 +4,9 @@ from estnltk.text import Text
 from estnltk.layer.layer import Layer
 from typing import MutableMapping
 from collections import defaultdict
+from functools import lru_cache
+from models.gazetteer_index import get_gazetteer_index
+from models.gazetteer_variants import canonical_key
 import codecs
 import os
 
@@ -45,6 +48,93 @@ class NerEmptyFeatureTagger(Tagger):
 
         return layer
 
+# Character-level features of a word type. The features depend only on the string, so they
+# are computed once per unique string and kept in an LRU cache that is shared by all
+# documents (local_features.cache_info() shows the hits and misses).
+@lru_cache(maxsize=200000)
+def local_features(text):
+    shape = get_shape(text)
+    bdash, adash = split_char(text, '-')
+    bdot, adot = split_char(text, '.')
+    return {
+        # Token.
+        'w': text,
+        # Lowercased token.
+        'w1': text.lower(),
+        # Token shape.
+        'shape': shape,
+        # Token shape degenerated.
+        'shaped': degenerate(shape),
+
+        # Prefixes (length between one to four).
+        'p1': text[0] if len(text) >= 1 else None,
+        'p2': text[:2] if len(text) >= 2 else None,
+        'p3': text[:3] if len(text) >= 3 else None,
+        'p4': text[:4] if len(text) >= 4 else None,
+
+        # Suffixes (length between one to four).
+        's1': text[-1] if len(text) >= 1 else None,
+        's2': text[-2:] if len(text) >= 2 else None,
+        's3': text[-3:] if len(text) >= 3 else None,
+        's4': text[-4:] if len(text) >= 4 else None,
+
+        # Two digits
+        'd2': b(get_2d(text)),
+        # Four digits
+        'd4': b(get_4d(text)),
+        # Digits and '-'.
+        'dndash': b(get_dand(text, '-')),
+        # Digits and '/'.
+        'dnslash': b(get_dand(text, '/')),
+        # Digits and ','.
+        'dncomma': b(get_dand(text, ',')),
+        # Digits and '.'.
+        'dndot': b(get_dand(text, '.')),
+        # A uppercase letter followed by '.'
+        'up': b(get_capperiod(text)),
+
+        # An initial uppercase letter.
+        'iu': b(text and text[0].isupper()),
+        # All uppercase letters.
+        'au': b(text.isupper()),
+        # All lowercase letters.
+        'al': b(text.islower()),
+        # All digit letters.
+        'ad': b(text.isdigit()),
+        # All other (non-alphanumeric) letters.
+        'ao': b(get_all_other(text)),
+        # Alphanumeric token.
+        'aan': b(text.isalnum()),
+
+        # Contains an uppercase letter.
+        'cu': b(contains_upper(text)),
+        # Contains a lowercase letter.
+        'cl': b(contains_lower(text)),
+        # Contains a alphabet letter.
+        'ca': b(contains_alpha(text)),
+        # Contains a digit.
+        'cd': b(contains_digit(text)),
+        # Contains an apostrophe.
+        'cp': b(text.find("'") > -1),
+        # Contains a dash.
+        'cds': b(text.find("-") > -1),
+        # Contains a dot.
+        'cdt': b(text.find(".") > -1),
+        # Contains a symbol.
+        'cs': b(contains_symbol(text)),
+
+        # Before, after dash
+        'bdash': bdash,
+        'adash': adash,
+
+        # Before, after dot
+        'bdot': bdot,
+        'adot': adot,
+
+        # Length
+        'len': str(len(text))
+    }
+
 class NerLocalFeatureWithoutMorphTagger(Retagger):
     """Generates features for a token based on its character makeup."""
     conf_param = ['settings']
@@ -58,83 +148,11 @@ class NerLocalFeatureWithoutMorphTagger(Retagger):
     def _change_layer(self, text: Text, layers: MutableMapping[str, Layer], status: dict):
         ner_features_layer = layers[self.output_layer]
         words_layer = layers['words']
-        for i, token in enumerate( words_layer ):
-            # Token.
-            ner_features_layer[i].w = token.text
-            # Lowercased token.
-            ner_features_layer[i].w1 = token.text.lower()
-            # Token shape.
-            ner_features_layer[i].shape = get_shape(token.text)
-            # Token shape degenerated.
-            ner_features_layer[i].shaped = degenerate(get_shape(token.text))
-            
-            # Prefixes (length between one to four).
-            ner_features_layer[i].p1 = token.text[0] if len(token.text) >= 1 else None
-            ner_features_layer[i].p2 = token.text[:2] if len(token.text) >= 2 else None
-            ner_features_layer[i].p3 = token.text[:3] if len(token.text) >= 3 else None
-            ner_features_layer[i].p4 = token.text[:4] if len(token.text) >= 4 else None
-
-            # Suffixes (length between one to four).
-            ner_features_layer[i].s1 = token.text[-1] if len(token.text) >= 1 else None
-            ner_features_layer[i].s2 = token.text[-2:] if len(token.text) >= 2 else None
-            ner_features_layer[i].s3 = token.text[-3:] if len(token.text) >= 3 else None
-            ner_features_layer[i].s4 = token.text[-4:] if len(token.text) >= 4 else None
-            
-            # Two digits
-            ner_features_layer[i].d2 = b(get_2d(token.text))
-            # Four digits
-            ner_features_layer[i].d4 = b(get_4d(token.text))
-            # Digits and '-'.
-            ner_features_layer[i].dndash = b(get_dand(token.text, '-'))
-            # Digits and '/'.
-            ner_features_layer[i].dnslash = b(get_dand(token.text, '/'))
-            # Digits and ','.
-            ner_features_layer[i].dncomma = b(get_dand(token.text, ','))
-            # Digits and '.'.
-            ner_features_layer[i].dndot = b(get_dand(token.text, '.'))
-            # A uppercase letter followed by '.'
-            ner_features_layer[i].up = b(get_capperiod(token.text))
-
-            # An initial uppercase letter.
-            ner_features_layer[i].iu = b(token.text and token.text[0].isupper())
-            # All uppercase letters.
-            ner_features_layer[i].au = b(token.text.isupper())
-            # All lowercase letters.
-            ner_features_layer[i].al = b(token.text.islower())
-            # All digit letters.
-            ner_features_layer[i].ad = b(token.text.isdigit())
-            # All other (non-alphanumeric) letters.
-            ner_features_layer[i].ao = b(get_all_other(token.text))
-            # Alphanumeric token.
-            ner_features_layer[i].aan = b(token.text.isalnum())
-
-            # Contains an uppercase letter.
-            ner_features_layer[i].cu = b(contains_upper(token.text))
-            # Contains a lowercase letter.
-            ner_features_layer[i].cl = b(contains_lower(token.text))
-            # Contains a alphabet letter.
-            ner_features_layer[i].ca = b(contains_alpha(token.text))
-            # Contains a digit.
-            ner_features_layer[i].cd = b(contains_digit(token.text))
-            # Contains an apostrophe.
-            ner_features_layer[i].cp = b(token.text.find("'") > -1)
-            # Contains a dash.
-            ner_features_layer[i].cds = b(token.text.find("-") > -1)
-            # Contains a dot.
-            ner_features_layer[i].cdt = b(token.text.find(".") > -1)
-            # Contains a symbol.
-            ner_features_layer[i].cs = b(contains_symbol(token.text))
-            
-            # Before, after dash
-            ner_features_layer[i].bdash = split_char(token.text, '-')[0]
-            ner_features_layer[i].adash = split_char(token.text, '-')[1]
-
-            # Before, after dot
-            ner_features_layer[i].bdot = split_char(token.text, '.')[0]
-            ner_features_layer[i].adot = split_char(token.text, '.')[1]
-
-            # Length
-            ner_features_layer[i].len = str(len(token.text))
+        for features_span, token in zip(ner_features_layer, words_layer):
+            features = local_features(token.text)
+            for annotation in features_span.annotations:
+                for key, value in features.items():
+                    annotation[key] = value
             
 class NerBasicMorphFeatureTagger(Retagger):
     """Extracts features provided by the morphological analyser pyvabamorf. """
@@ -232,9 +250,13 @@ class NerGazetteerFeatureTagger(Retagger):
     assign t['gaz'] = ['PER', 'ORG']. With the parameter look_ahead, it is possible to
     compose multi-token phrases for dictionary lookup. When look_ahead=N, phrases
     (t[i], ..., t[i+N]) will be composed. If the phrase matches the dictionary, each
-    token will be assigned the corresponding value.
+    token will be assigned the corresponding value. The gazetteer is compiled into an
+    index that is shared by all taggers of the process (see models.gazetteer_index).
+    With GAZETTEER_LOOKUP = 'canonical' in settings.py, the phrases are matched by their
+    canonical keys, which are the same for the old and new spellings of a name (see
+    models.gazetteer_variants); the default is GAZETTEER_LOOKUP = 'exact'.
     """
-    conf_param = ['settings', 'look_ahead', 'data']
+    conf_param = ['settings', 'look_ahead', 'canonical', 'data']
 
     def __init__(self, settings, look_ahead=3, output_layer='ner_features', output_attributes=(),
                  input_layers=['ner_features']):
@@ -244,25 +266,238 @@ class NerGazetteerFeatureTagger(Retagger):
         self.output_attributes = output_attributes
         self.input_layers = input_layers
 
-        self.data = defaultdict(set)
-        with codecs.open(settings.GAZETTEER_FILE, 'rb', encoding="utf8") as f:
-            for ln in f:
-                word, lbl = ln.strip().rsplit("\t", 1)
-                self.data[word].add(lbl)
+        self.canonical = getattr(settings, 'GAZETTEER_LOOKUP', 'exact') == 'canonical'
+        self.data = get_gazetteer_index(settings.GAZETTEER_FILE, self.canonical)
 
     def _change_layer(self, text: Text, layers: MutableMapping[str, Layer], status: dict):
             layer = layers[self.output_layer]
             layer.attributes += tuple(self.output_attributes)
             tokens = list(layer)
-            look_ahead = self.look_ahead
-            for i in range(len(tokens)):
-                if tokens[i].ner_features.iu[0] is not None: # Only capitalised strings
-                    for j in range(i + 1, i + 1 + look_ahead):
-                        lemmas = []
-                        for token in tokens[i:j]:
-                            lemmas.append(token.text)
-                        phrase = " ".join(lemmas)
-                        if phrase.lower() in self.data:
-                            labels = self.data[phrase.lower()]
-                            for tok in tokens[i:j]:
-                                tok.ner_features.gaz = labels
\ No newline at end of file
+            keys = [token.text.lower() for token in tokens]
+            if self.canonical:
+                keys = [canonical_key(key) for key in keys]
+            # Only capitalised strings
+            starts = [token.annotations[0]['iu'] is not None for token in tokens]
+            # Later (and longer) matches overwrite the labels of earlier ones
+            for start, end, labels in self.data.matches(keys, starts, self.look_ahead):
+                for token in tokens[start:end]:
+                    for annotation in token.annotations:
+                        annotation['gaz'] = labels
+# All attributes of the 'ner_features' layer (see NerEmptyFeatureTagger)
+ner_feature_attributes = ("lem", "pos", "prop", "pref", "post", "case",
+                          "ending", "pun", "w", "w1", "shape", "shaped", "p1",
+                          "p2", "p3", "p4", "s1", "s2", "s3", "s4", "d2",
+                          "d4", "dndash", "dnslash", "dncomma", "dndot", "up", "iu", "au",
+                          "al", "ad", "ao", "aan", "cu", "cl", "ca", "cd",
+                          "cp", "cds", "cdt", "cs", "bdash", "adash",
+                          "bdot", "adot", "len", "fsnt", "lsnt", "gaz",
+                          "prew", "next", "iuoc", "pprop", "nprop", "pgaz",
+                          "ngaz", "F")
+
+# Feature extractors that NerFusedFeatureTagger can replace (its default chain is the
+# chain of the best models, with the gazetteer that looks up the word forms)
+fused_feature_extractors = (
+    "models.protocols_fex.NerLocalFeatureWithoutMorphTagger",
+    "models.protocols_fex.NerBasicMorphFeatureTagger",
+    "models.protocols_fex.NerMorphNoLemmasFeatureTagger",
+    "estnltk.taggers.estner.fex.NerSentenceFeatureTagger",
+    "models.protocols_fex.NerGazetteerFeatureTagger",
+    "estnltk.taggers.estner.fex.NerGazetteerFeatureTagger",
+    "estnltk.taggers.estner.fex.NerGlobalContextFeatureTagger"
+)
+default_fused_feature_extractors = (
+    "models.protocols_fex.NerLocalFeatureWithoutMorphTagger",
+    "models.protocols_fex.NerBasicMorphFeatureTagger",
+    "estnltk.taggers.estner.fex.NerSentenceFeatureTagger",
+    "models.protocols_fex.NerGazetteerFeatureTagger",
+    "estnltk.taggers.estner.fex.NerGlobalContextFeatureTagger"
+)
+
+# Attributes set by the feature extractors that use the morphological analysis
+basic_morph_attributes = {"lem", "pos", "prop", "pref", "post", "case", "ending", "pun",
+                          "p1", "p2", "p3", "p4", "s1", "s2", "s3", "s4",
+                          "bdash", "adash", "bdot", "adot", "len"}
+morph_no_lemmas_attributes = {"pos", "prop", "case", "pun"}
+global_context_attributes = {"iuoc", "pprop", "nprop", "pgaz", "ngaz"}
+
+quotation_marks = {u'”', u'„', u'“'}
+
+# Return the lemma of a word as the feature extractors form it from its first analysis
+def morph_lemma(morph, word_text, lowercase_ending=False):
+    ending = ('+' + morph.ending[0] if morph.ending[0] else '')
+    LEM = '_'.join(morph.root_tokens[0]) + (ending.lower() if lowercase_ending else ending)
+    if not LEM:
+        LEM = word_text
+    return get_lemma(LEM)
+
+class NerFusedFeatureTagger(Tagger):
+    """Creates the 'ner_features' layer in a single tagger instead of a chain of feature
+    extractors (NerEmptyFeatureTagger followed by retaggers). Only the attributes that
+    are used by settings.TEMPLATES (and the attributes these depend on) are computed and
+    added to the layer. The replaced chain is given by settings.FUSED_FEATURE_EXTRACTORS
+    (default_fused_feature_extractors if it is not set); the features are the same as the
+    chain's, except 'prew' and 'next', which are not added. To use it, set
+    FEATURE_EXTRACTORS = ("models.protocols_fex.NerFusedFeatureTagger",) in settings.py.
+    """
+    conf_param = ['settings', 'look_ahead', 'extractors', 'needed_attributes', 'canonical', 'data']
+
+    def __init__(self, settings, input_layers=('morph_analysis', 'words', 'sentences'), output_layer='ner_features',
+                 look_ahead=3):
+        self.settings = settings
+        self.look_ahead = look_ahead
+        self.output_layer = output_layer
+        self.input_layers = tuple(input_layers)
+
+        self.extractors = tuple(getattr(settings, 'FUSED_FEATURE_EXTRACTORS', default_fused_feature_extractors))
+        unknown = [extractor for extractor in self.extractors if extractor not in fused_feature_extractors]
+        if unknown:
+            raise ValueError('NerFusedFeatureTagger cannot replace the feature extractors {}'.format(unknown))
+
+        used = {attribute for template in settings.TEMPLATES for attribute, offset in template}
+        needed = set(used)
+        if used & global_context_attributes:
+            needed |= {'iu', 'fsnt'}
+            if used & {'pprop', 'nprop'}:
+                needed.add('prop')
+            if used & {'pgaz', 'ngaz'}:
+                needed.add('gaz')
+        if 'gaz' in needed:
+            needed.add('iu')
+        self.needed_attributes = needed
+        self.output_attributes = tuple(attribute for attribute in ner_feature_attributes
+                                       if attribute in used and attribute not in ('prew', 'next', 'F')) + ('F',)
+
+        self.canonical = getattr(settings, 'GAZETTEER_LOOKUP', 'exact') == 'canonical'
+        self.data = None
+        if 'gaz' in needed and any('GazetteerFeatureTagger' in extractor for extractor in self.extractors):
+            self.data = get_gazetteer_index(settings.GAZETTEER_FILE, self.canonical)
+
+    def _uses(self, extractor, attributes):
+        return extractor in self.extractors and bool(self.needed_attributes & attributes)
+
+    def _make_layer(self, text: Text, layers: MutableMapping[str, Layer], status: dict):
+        morph_layer_name, words_layer_name, sentences_layer_name = self.input_layers[:3]
+        words = layers[words_layer_name]
+        texts = [word.text for word in words]
+        # morph_layer_input is the words layer for the models without morphology
+        morphs = list(layers[morph_layer_name]) if morph_layer_name != words_layer_name else None
+        records = [dict() for _ in texts]
+
+        # Features of single words, in the order of the replaced extractors
+        for extractor in self.extractors:
+            if extractor == "models.protocols_fex.NerLocalFeatureWithoutMorphTagger":
+                for record, word_text in zip(records, texts):
+                    record.update(local_features(word_text))
+            elif extractor == "models.protocols_fex.NerBasicMorphFeatureTagger" and \
+                    self.needed_attributes & basic_morph_attributes:
+                for record, morph, word_text in zip(records, morphs, texts):
+                    LEM = morph_lemma(morph, word_text)
+                    bdash, adash = split_char(LEM, '-')
+                    bdot, adot = split_char(LEM, '.')
+                    pos = get_pos(morph.partofspeech)
+                    record.update(lem=get_lemma(LEM), pos=pos, prop=b(is_prop(morph.partofspeech)),
+                                  pref=get_word_parts(morph.root_tokens[0])[0],
+                                  post=get_word_parts(morph.root_tokens[0])[1],
+                                  case=get_case(morph.form[0]), ending=get_ending(morph.ending),
+                                  pun=b(pos == "_Z_"),
+                                  p1=LEM[0] if len(LEM) >= 1 else None, p2=LEM[:2] if len(LEM) >= 2 else None,
+                                  p3=LEM[:3] if len(LEM) >= 3 else None, p4=LEM[:4] if len(LEM) >= 4 else None,
+                                  s1=LEM[-1] if len(LEM) >= 1 else None, s2=LEM[-2:] if len(LEM) >= 2 else None,
+                                  s3=LEM[-3:] if len(LEM) >= 3 else None, s4=LEM[-4:] if len(LEM) >= 4 else None,
+                                  bdash=bdash, adash=adash, bdot=bdot, adot=adot, len=str(len(LEM)))
+            elif extractor == "models.protocols_fex.NerMorphNoLemmasFeatureTagger" and \
+                    self.needed_attributes & morph_no_lemmas_attributes:
+                for record, morph in zip(records, morphs):
+                    pos = get_pos(morph.partofspeech)
+                    record.update(pos=pos, prop=b(is_prop(morph.partofspeech)), case=get_case(morph.form[0]),
+                                  pun=b(pos == "_Z_"))
+
+        # Word indexes of the sentences (the sentences cover all words in order)
+        sentence_bounds = []
+        start = 0
+        for sentence in layers[sentences_layer_name]:
+            sentence_bounds.append((start, start + len(sentence)))
+            start += len(sentence)
+
+        if self._uses("estnltk.taggers.estner.fex.NerSentenceFeatureTagger", {'fsnt', 'lsnt'}):
+            for start, end in sentence_bounds:
+                if end > start:
+                    records[start]['fsnt'] = 'y'
+                    records[end - 1]['lsnt'] = 'y'
+
+        if self.data is not None:
+            if "models.protocols_fex.NerGazetteerFeatureTagger" in self.extractors:
+                keys = [word_text.lower() for word_text in texts]
+            else:
+                keys = [morph_lemma(morph, word_text, lowercase_ending=True) for morph, word_text in zip(morphs, texts)]
+            if self.canonical:
+                keys = [canonical_key(key) for key in keys]
+            # Only capitalised strings
+            starts = [record.get('iu') is not None for record in records]
+            for start, end, labels in self.data.matches(keys, starts, self.look_ahead):
+                for record in records[start:end]:
+                    record['gaz'] = labels
+
+        if self._uses("estnltk.taggers.estner.fex.NerGlobalContextFeatureTagger", global_context_attributes):
+            self._global_context(records, texts, morphs, sentence_bounds)
+
+        layer = Layer(self.output_layer, ambiguous=True, attributes=self.output_attributes, text_object=text)
+        attributes = self.output_attributes[:-1]
+        for word, record in zip(words, records):
+            layer.add_annotation(word, F=None, **{attribute: record.get(attribute) for attribute in attributes})
+        return layer
+
+    # The features of NerGlobalContextFeatureTagger: capitalised lemmas that occur elsewhere in
+    # the text (iuoc) and whether their neighbours are proper names (pprop, nprop) or in the
+    # gazetteer (pgaz, ngaz)
+    def _global_context(self, records, texts, morphs, sentence_bounds):
+        previous = [None] * len(texts)
+        following = [None] * len(texts)
+        for start, end in sentence_bounds:
+            for i in range(start + 1, end):
+                previous[i] = i - 1
+            for i in range(start, end - 1):
+                following[i] = i + 1
+
+        if morphs is not None:
+            lemmas = [morph_lemma(morph, word_text) for morph, word_text in zip(morphs, texts)]
+        else:
+            lemmas = [get_lemma(word_text) for word_text in texts]
+
+        ui_lems = set()
+        for i, record in enumerate(records):
+            if record.get('iu') is not None and record.get('fsnt') is None:
+                if texts[i - 1] not in quotation_marks:
+                    ui_lems.add(lemmas[i])
+
+        sametoks_dict = defaultdict(list)
+        for i, lemma in enumerate(lemmas):
+            if lemma in ui_lems:
+                sametoks_dict[lemma].append(i)
+
+        for sametoks in sametoks_dict.values():
+            for i in sametoks:
+                records[i]['iuoc'] = 'y'
+
+            if any(previous[i] is not None and records[previous[i]].get('prop') is not None for i in sametoks):
+                for i in sametoks:
+                    records[i]['pprop'] = 'y'
+            if any(following[i] is not None and records[following[i]].get('prop') is not None for i in sametoks):
+                for i in sametoks:
+                    records[i]['nprop'] = 'y'
+
+            pgaz_set = set()
+            for i in sametoks:
+                if previous[i] is not None and records[previous[i]].get('gaz') is not None:
+                    pgaz_set.update(records[previous[i]]['gaz'])
+            if pgaz_set:
+                for i in sametoks:
+                    records[i]['pgaz'] = pgaz_set
+
+            ngaz_set = set()
+            for i in sametoks:
+                if following[i] is not None and records[following[i]].get('gaz') is not None:
+                    ngaz_set.update(records[following[i]]['gaz'])
+            if ngaz_set:
+                for i in sametoks:
+                    records[i]['ngaz'] = ngaz_set
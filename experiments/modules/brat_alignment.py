@@ -0,0 +1,77 @@
+import bisect
+
+# BRAT counts every linebreak of the protocol as two characters ('\r\n'), while the
+# text read in Python only has one ('\n'). A BRAT offset therefore equals the offset
+# in the text plus the number of linebreaks preceding it.
+#
+# The index is built once per document: a sorted list of BRAT offsets right after
+# each linebreak (a prefix-sum of the linebreaks) and sorted lists of word starts and
+# ends. Every annotation is then resolved with a couple of bisect lookups instead of
+# scanning all the words of the text.
+class BratAlignmentIndex:
+
+    def __init__(self, text, word_spans):
+        self.text = text
+        self.newline_ends = []
+        newlines_seen = 0
+        for position, character in enumerate(text):
+            if character == '\n':
+                newlines_seen += 1
+                self.newline_ends.append(position + newlines_seen + 1)
+        self.word_starts = [start for start, end in word_spans]
+        self.word_ends = [end for start, end in word_spans]
+
+    # Build the index from an EstNLTK Text object that has the 'words' layer
+    @classmethod
+    def from_text(cls, text):
+        return cls(text.text, [(word.start, word.end) for word in text.words])
+
+    # Convert a BRAT offset into an offset in the text
+    def to_text_offset(self, brat_offset):
+        return brat_offset - bisect.bisect_right(self.newline_ends, brat_offset)
+
+    # Return the index of the word starting exactly at the given text offset (or None)
+    def word_at(self, text_offset):
+        i = bisect.bisect_left(self.word_starts, text_offset)
+        if i < len(self.word_starts) and self.word_starts[i] == text_offset:
+            return i
+        return None
+
+    # Return the index of the last word ending at (or covering) the given text offset (or None)
+    def word_ending_at(self, text_offset):
+        i = bisect.bisect_left(self.word_ends, text_offset)
+        if i < len(self.word_ends) and self.word_starts[i] < text_offset:
+            return i
+        return None
+
+    # Align a BRAT span (start and end offsets) with the words of the text.
+    # Returns a tuple (first word index, last word index + 1) or None if the span does
+    # not start at a word boundary. Trailing whitespace and linebreaks inside the
+    # annotation (e.g. 'Gustav  Waddi' or 'Jaan ') are not counted towards the span.
+    def align(self, brat_start, brat_end):
+        start = self.to_text_offset(int(brat_start))
+        end = self.to_text_offset(int(brat_end))
+        while end > start and self.text[end - 1].isspace():
+            end -= 1
+
+        first = self.word_at(start)
+        if first is None:
+            return None
+        last = self.word_ending_at(end)
+        if last is None or last < first:
+            return None
+        return first, last + 1
+
+    # Align BRAT offsets given as a string (e.g. '388 393;394 398' for an annotation
+    # that is split by a linebreak). Only the first start and the last end are used.
+    def align_fragments(self, offsets):
+        fragments = [fragment.split() for fragment in offsets.split(';')]
+        return self.align(fragments[0][0], fragments[-1][-1])
+
+# Align all annotation records (as returned by collect_annotations) with the words of the text.
+# Yields tuples of the annotation and its word range (first word index, last word index + 1).
+def align_annotations(index, annotations):
+    for annotation in annotations:
+        word_range = index.align(annotation.start, annotation.end)
+        if word_range is not None:
+            yield annotation, word_range
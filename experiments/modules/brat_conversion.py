@@ -0,0 +1,294 @@
+import os
+import json
+import hashlib
+from multiprocessing import Pool
+
+from estnltk import EnvelopingBaseSpan
+from estnltk import Text, Layer, Annotation, EnvelopingSpan
+from estnltk.converters import text_to_json
+from estnltk.layer_operations import flatten
+
+from modules.preprocessing_protocols import preprocess_text, get_preprocessing_config
+from modules.collect_annotations import collect_annotations
+from modules.get_layer_difference import find_difference, write_difference_report
+from modules.brat_alignment import BratAlignmentIndex
+
+# Directories in which the brat-annotated files (*.txt and *.ann) are located
+directories = ["vallakohus_esimene", "vallakohus_teine", "vallakohus_kolmas", "vallakohus_neljas"]
+
+# Named entities in the BRAT-tool annotated files
+named_entities = {
+    "Isik": "PER",
+    "KO_koht": "LOC_ORG",
+    "KO_org": "LOC_ORG",
+    "Koht": "LOC",
+    "Org": "ORG",
+    "Muu": "MISC",
+    "Teadmata": "MISC",
+    "ese": "MISC"
+}
+
+# Version of the conversion code. Increase it when the conversion changes, so that
+# all files are converted again by the next run.
+converter_version = 2
+
+# Suffix of the file (next to the output directory) that lists the already converted protocols
+manifest_suffix = '.manifest.jsonl'
+
+# Suffix of the file (next to the output directory) that lists the differences between
+# the BRAT annotations and the converted annotations of all protocols
+difference_report_suffix = '.differences.jsonl'
+
+# Layers that are removed from the converted files to save space
+remove_layers = ['words', 'tokens', 'unflattened_gold_ner']
+
+# Return the BIO labels (B-PER, I-PER, O, ...) of all words of a document in one pass
+# entity_ranges: a list of tuples (label, first word index, last word index + 1).
+# If named entities overlap, the labels of the later ones are kept.
+def bio_labels(number_of_words, entity_ranges):
+    labels = ['O'] * number_of_words
+    for label, first, last in entity_ranges:
+        labels[first] = f'B-{label}'
+        for k in range(first + 1, last):
+            labels[k] = f'I-{label}'
+    return labels
+
+# Convert a BRAT-tool annotated protocol (a .txt and .ann file pair) into a Text object
+# with the layers 'gold_ner' and 'gold_wordner'
+# Output: the Text object and the report of differences between the annotations in the
+# BRAT file and on the text (None if there are none)
+def convert_protocol(path, file, directory, named_entities=named_entities):
+    with open(os.path.join(path, file), 'r', encoding="UTF-8") as in_txt:
+        in_txt = in_txt.read().replace(u'\xa0', ' ')
+
+    if file == "Tartu_V6nnu_Ahja_id3502_1882a.txt":
+        in_txt = in_txt.replace('..', '. .')
+
+    # Convert text into EstNLTK Text object and preprocess it
+    text = Text(in_txt)
+    text.meta['origin_directory'] = str(directory)
+    preprocess_text(text)
+
+    # Create NER layers
+    gold_ner_layer = Layer(name="unflattened_gold_ner", text_object=text, attributes=['nertag'])
+    gold_wordner_layer = Layer(name="unflattened_gold_wordner", text_object=text, attributes=['nertag'], parent="words")
+
+    # Fix annotations
+    with open(os.path.join(path, file.split(".")[0] + ".ann"), 'r', encoding="UTF-8") as in_ann:
+        fixed_annotations = collect_annotations(in_ann)
+
+    # Collect the annotations in a separate dictionary
+    annotation_dictionary = {}
+    for annotation in fixed_annotations:
+        annotation_dictionary[annotation.trigger] = annotation
+
+    # Index the linebreaks and word boundaries of the text once per document
+    alignment_index = BratAlignmentIndex.from_text(text)
+    entity_ranges = []
+
+    # Iterate through the keys (triggers) of the dictionary
+    for key in annotation_dictionary:
+        annotation = annotation_dictionary.get(key)
+        ner = annotation.tag
+
+        # Find the words covered by the annotation
+        word_range = alignment_index.align(annotation.start, annotation.end)
+        if word_range is None:
+            continue
+        first, last = word_range
+        name = [text.words[k] for k in range(first, last)]
+
+        base_span = EnvelopingBaseSpan([s.base_span for s in name])
+        new_span = EnvelopingSpan(base_span, layer=gold_ner_layer)
+
+        # Create named entities based on aforementioned spans
+        new_span.add_annotation(Annotation(new_span, nertag=named_entities[ner]))
+        entity_ranges.append((named_entities[ner], first, last))
+
+        gold_ner_layer.add_span(new_span)
+    text.add_layer(gold_ner_layer)
+
+    # Find the difference between annotations in the file and annotations on the text
+    difference = find_difference(file, fixed_annotations, text.unflattened_gold_ner)
+
+    # Create wordner annotations (files without named entities get an empty layer)
+    if entity_ranges:
+        for word, label in zip(text.words, bio_labels(len(text.words), entity_ranges)):
+            gold_wordner_layer.add_annotation(word.base_span, nertag=label)
+
+    text.add_layer(gold_wordner_layer)
+
+    # Flatten the layers and remove extra layers to save space
+    text.add_layer(flatten(text['unflattened_gold_ner'], 'gold_ner'))
+    text.add_layer(flatten(text['unflattened_gold_wordner'], 'gold_wordner'))
+
+    for layer in remove_layers:
+        text.pop_layer(layer)
+
+    text.gold_wordner.ambiguous = False
+    text.gold_ner.ambiguous = False
+
+    return text, difference
+
+# Convert a protocol and save it as a .json file. The file is first written under a
+# temporary name, so that an interrupted conversion never leaves a half-written file.
+# Input: a job tuple (directory, location of the directory, .txt filename, output directory)
+# Output: a manifest entry of the converted file
+def convert_and_save(job):
+    directory, path, file, json_files_location = job
+    text, difference = convert_protocol(path, file, directory)
+
+    json_file = file.replace(".txt", ".json")
+    temporary_file = os.path.join(json_files_location, json_file + '.tmp')
+    text_to_json(text, file=temporary_file)
+    os.replace(temporary_file, os.path.join(json_files_location, json_file))
+
+    entry = {'file': json_file, 'source': os.path.join(directory, file)}
+    if difference is not None:
+        entry['difference'] = difference
+    return entry
+
+# Return the SHA-256 hash of a file's contents
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as in_f:
+        for block in iter(lambda: in_f.read(1 << 16), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+# Return the SHA-256 hash of the conversion and preprocessing settings
+def config_hash(named_entities=named_entities):
+    config = {
+        'converter_version': converter_version,
+        'named_entities': named_entities,
+        'preprocessing': get_preprocessing_config()
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('UTF-8')).hexdigest()
+
+# Return the hashes of a protocol's .txt and .ann files and of the configuration
+def source_hashes(path, file, config_sha):
+    return {
+        'txt_sha': file_hash(os.path.join(path, file)),
+        'ann_sha': file_hash(os.path.join(path, file.split(".")[0] + ".ann")),
+        'config_sha': config_sha
+    }
+
+# Return a list of conversion jobs for all .txt files in the directories
+def find_conversion_jobs(vallakohtufailid_location, directories, json_files_location):
+    jobs = []
+    for directory in directories:
+        path = os.path.join(vallakohtufailid_location, directory)
+        for file in sorted(os.listdir(path)):
+            if file.endswith('.txt'):
+                jobs.append((directory, path, file, json_files_location))
+    return jobs
+
+# Return the location of the manifest file. It is kept next to (and not inside) the
+# output directory, as other stages list the output directory.
+def get_manifest_file(json_files_location):
+    return os.path.normpath(json_files_location) + manifest_suffix
+
+# Read the manifest of already converted files
+# Output: a dictionary {json filename: manifest entry}
+def read_manifest(json_files_location):
+    manifest = dict()
+    manifest_file = get_manifest_file(json_files_location)
+    if not os.path.exists(manifest_file):
+        return manifest
+
+    with open(manifest_file, 'r', encoding='UTF-8') as in_f:
+        for line in in_f:
+            # The last line may be incomplete if the previous run was killed
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            manifest[entry['file']] = entry
+    return manifest
+
+# Write the manifest of converted files (one JSON object per line)
+def write_manifest(json_files_location, manifest):
+    manifest_file = get_manifest_file(json_files_location)
+    with open(manifest_file + '.tmp', 'w', encoding='UTF-8') as out_f:
+        for file in sorted(manifest):
+            out_f.write(json.dumps(manifest[file], ensure_ascii=False) + '\n')
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+# Convert all BRAT-tool annotated files in the directories into .json files.
+# The manifest stores the hashes of every converted file's .txt and .ann and of the
+# configuration, so only files whose sources or configuration changed since the last
+# run (or that an interrupted run did not finish) are converted. Outputs whose sources
+# have disappeared are deleted. The files are divided between a pool of worker processes.
+def convert_corpus(vallakohtufailid_location, directories, json_files_location, workers=None, chunk_size=4, restart=False):
+    if not os.path.exists(json_files_location):
+        os.mkdir(json_files_location)
+
+    # Remove files left over from an interrupted run
+    for file in os.listdir(json_files_location):
+        if file.endswith('.tmp'):
+            os.remove(os.path.join(json_files_location, file))
+
+    manifest_file = get_manifest_file(json_files_location)
+    if restart and os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    manifest = read_manifest(json_files_location)
+
+    config_sha = config_hash()
+    jobs = []
+    hashes = dict()
+    sources = set()
+    for job in find_conversion_jobs(vallakohtufailid_location, directories, json_files_location):
+        directory, path, file, _ = job
+        json_file = file.replace(".txt", ".json")
+        sources.add(json_file)
+        hashes[json_file] = source_hashes(path, file, config_sha)
+
+        entry = manifest.get(json_file)
+        if entry is not None and os.path.exists(os.path.join(json_files_location, json_file)) and \
+           all(entry.get(key) == value for key, value in hashes[json_file].items()):
+            continue
+        jobs.append(job)
+
+    # Delete the outputs of protocols that are no longer in the converted directories
+    removed = 0
+    for json_file, entry in list(manifest.items()):
+        if json_file in sources or entry['source'].split(os.sep)[0] not in directories:
+            continue
+        if os.path.exists(os.path.join(json_files_location, json_file)):
+            os.remove(os.path.join(json_files_location, json_file))
+        del manifest[json_file]
+        removed += 1
+
+    # Rewrite the manifest to drop duplicate, incomplete and removed lines before appending to it
+    write_manifest(json_files_location, manifest)
+
+    print(f"(!) {len(jobs)} files to convert, {len(sources) - len(jobs)} files up to date, {removed} files removed")
+
+    with open(manifest_file, 'a', encoding='UTF-8') as out_manifest:
+        if workers == 1:
+            results = map(convert_and_save, jobs)
+            pool = None
+        else:
+            pool = Pool(processes=workers)
+            results = pool.imap_unordered(convert_and_save, jobs, chunksize=chunk_size)
+
+        try:
+            for iterator, entry in enumerate(results, start=1):
+                entry.update(hashes[entry['file']])
+                out_manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                out_manifest.flush()
+                if iterator % 100 == 0:
+                    print(f"(!) {iterator}/{len(jobs)} files converted")
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    # Collect the differences of all converted files (including the ones converted by
+    # earlier runs) into one report
+    reports = [entry['difference'] for entry in read_manifest(json_files_location).values() if 'difference' in entry]
+    report_file = os.path.normpath(json_files_location) + difference_report_suffix
+    write_difference_report(reports, report_file)
+    print(f"(!) {len(reports)} files have differences between the BRAT and converted annotations, see {report_file}")
+
+    print("(!) The code has finished!")
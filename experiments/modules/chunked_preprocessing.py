@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import tempfile
+
+from estnltk import Text
+from estnltk.converters import layer_to_dict, dict_to_layer, text_to_json
+from estnltk.layer.layer import to_base_span
+
+from modules.manual_morph import is_manually_analysed
+from modules.preprocessing_protocols import preprocess_text
+
+# A new case of a protocol starts after a paragraph ending ("\n\n", where EstNLTK's sentence
+# tokenizer always ends a sentence) or on a line that begins with the number of the case,
+# e.g. "1)" or "2.", after a line that ends with ".", "!" or "?". The number has at most
+# three digits and the line before it has to end a sentence, so a line that begins with a year or a date
+# in the middle of a sentence (e.g. "1873. aastal" or "2. Mail") is not a boundary.
+case_boundary_pattern = re.compile(r'\n\n|(?<=[.!?])[ \t]*\n(?=[ \t]*\d{1,3}[).][ \t]*\S)')
+
+# Split a text at case boundaries into chunks of at most max_chunk_size characters
+# (a case that is longer than max_chunk_size is kept in one chunk)
+# Output: a list of tuples (start, end)
+def find_chunks(text_str, max_chunk_size=5000):
+    boundaries = [match.end() for match in case_boundary_pattern.finditer(text_str)] + [len(text_str)]
+    chunks = []
+    start = 0
+    end = 0
+    for boundary in boundaries:
+        if boundary - start > max_chunk_size and end > start:
+            chunks.append((start, end))
+            start = end
+        end = boundary
+    if end > start:
+        chunks.append((start, end))
+    return chunks
+
+# Move a base span (as given by layer_to_dict) by offset characters
+def shift_base_span(base_span, offset):
+    if isinstance(base_span[0], int):
+        return (base_span[0] + offset, base_span[1] + offset)
+    return tuple(shift_base_span(span, offset) for span in base_span)
+
+# Preprocess (and tag) the text chunk by chunk
+# taggers: taggers that are applied to every chunk after preprocess_text (e.g. NerTagger)
+# Output: a generator of tuples (start of the chunk in the text, preprocessed Text of the chunk)
+def iter_preprocessed_chunks(text_str, max_chunk_size=5000, taggers=(), **preprocess_options):
+    for start, end in find_chunks(text_str, max_chunk_size):
+        chunk = preprocess_text(Text(text_str[start:end]), **preprocess_options)
+        for tagger in taggers:
+            tagger.tag(chunk)
+        yield start, chunk
+
+# Preprocess (and tag) the text chunk by chunk and emit the layers of each chunk as soon as
+# the chunk is done, with the offsets moved to the whole text
+# Output: a generator of layer dictionaries (as given by layer_to_dict), one for each layer of each chunk
+def iter_chunk_layer_dicts(text_str, max_chunk_size=5000, taggers=(), **preprocess_options):
+    for start, chunk in iter_preprocessed_chunks(text_str, max_chunk_size, taggers, **preprocess_options):
+        for layer in chunk.list_layers():
+            layer_dict = layer_to_dict(layer)
+            layer_dict['spans'] = [{'base_span': shift_base_span(span['base_span'], start),
+                                    'annotations': span['annotations']}
+                                   for span in layer_dict['spans']]
+            yield layer_dict
+
+# Return True if the text has to be preprocessed at once: short texts and the hand-analysed
+# protocols (whose manual analyses belong to the whole text)
+def preprocess_at_once(text, chunks, preprocess_options):
+    return len(chunks) <= 1 or (preprocess_options.get('use_manual_morph', False) and is_manually_analysed(text))
+
+# A streaming version of preprocess_text for long protocols (multi-case registers): the
+# text is split at case boundaries into chunks of at most max_chunk_size characters, which
+# are preprocessed (and tagged with the taggers) one at a time. The spans of each chunk are
+# added to the layers of the whole text with the offsets moved before the next chunk is
+# preprocessed, so the taggers only ever hold one chunk. The Text that is returned still
+# holds all layers of the whole text; write_preprocessed_chunked does not keep them in memory.
+# The hand-analysed protocols and short texts are preprocessed at once.
+def preprocess_text_chunked(text, max_chunk_size=5000, taggers=(), **preprocess_options):
+    chunks = find_chunks(text.text, max_chunk_size)
+    if preprocess_at_once(text, chunks, preprocess_options):
+        preprocess_text(text, **preprocess_options)
+        for tagger in taggers:
+            tagger.tag(text)
+        return text
+
+    existing_layers = set(text.layers)
+    for layer_dict in iter_chunk_layer_dicts(text.text, max_chunk_size, taggers, **preprocess_options):
+        if layer_dict['name'] in existing_layers:
+            continue
+        if layer_dict['name'] not in text.layers:
+            text.add_layer(dict_to_layer(dict(layer_dict, spans=[]), text))
+        layer = text[layer_dict['name']]
+        for span in layer_dict['spans']:
+            base_span = to_base_span(span['base_span'])
+            for annotation in span['annotations']:
+                layer.add_annotation(base_span, **annotation)
+    return text
+
+# Preprocess (and tag) a long protocol chunk by chunk (see preprocess_text_chunked) and write
+# it into an EstNLTK .json file (readable with json_to_text). The spans of each chunk are
+# written into a temporary file per layer as soon as the chunk is done, and the .json file is
+# put together from these files, so only one chunk is held in memory at a time. The layers
+# that the text already has are written after the preprocessed layers.
+def write_preprocessed_chunked(text, path, max_chunk_size=5000, taggers=(), **preprocess_options):
+    chunks = find_chunks(text.text, max_chunk_size)
+    if preprocess_at_once(text, chunks, preprocess_options):
+        text_to_json(preprocess_text_chunked(text, max_chunk_size, taggers, **preprocess_options), file=path)
+        return
+
+    with tempfile.TemporaryDirectory() as spool_location:
+        # {layer name: (layer dictionary without the spans, file with one span per line)}
+        spooled_layers = dict()
+        try:
+            for layer_dict in iter_chunk_layer_dicts(text.text, max_chunk_size, taggers, **preprocess_options):
+                if layer_dict['name'] in text.layers:
+                    continue
+                if layer_dict['name'] not in spooled_layers:
+                    spans_file = open(os.path.join(spool_location, f'{len(spooled_layers)}.jsonl'), 'w+', encoding='UTF-8')
+                    spooled_layers[layer_dict['name']] = ({key: value for key, value in layer_dict.items() if key != 'spans'}, spans_file)
+                spans_file = spooled_layers[layer_dict['name']][1]
+                for span in layer_dict['spans']:
+                    spans_file.write(json.dumps(span, ensure_ascii=False) + '\n')
+
+            with open(path, 'w', encoding='UTF-8') as out_f:
+                out_f.write('{"text": ' + json.dumps(text.text, ensure_ascii=False) +
+                            ', "meta": ' + json.dumps(text.meta, ensure_ascii=False) + ', "layers": [')
+                separator = ''
+                for layer_header, spans_file in spooled_layers.values():
+                    out_f.write(separator + json.dumps(layer_header, ensure_ascii=False)[:-1] + ', "spans": [')
+                    spans_file.seek(0)
+                    for i, line in enumerate(spans_file):
+                        out_f.write((', ' if i > 0 else '') + line.rstrip('\n'))
+                    out_f.write(']}')
+                    separator = ', '
+                for layer in text.list_layers():
+                    out_f.write(separator + json.dumps(layer_to_dict(layer), ensure_ascii=False))
+                    separator = ', '
+                out_f.write(']}')
+        finally:
+            for layer_header, spans_file in spooled_layers.values():
+                spans_file.close()
@@ -1,49 +1,56 @@
 import re
+from collections import namedtuple
+
+# A BRAT text-bound annotation. The fields keep the order of the tuples that were
+# previously returned (tag, start, end, text, trigger), so records can still be indexed.
+BratAnnotation = namedtuple('BratAnnotation', ['tag', 'start', 'end', 'text', 'trigger'])
 
 # If the annotation contains newline character, then indexes will contain ';' at the linebreak (e.g. 388 393;394 398 )
-def collect_annotations( in_f ):
-    indexes_on_line_split = re.compile(r' (\d+) (\d+;\d+ ){1,}(\d+)$')
-    annotations = []
+indexes_on_line_split = re.compile(r' (\d+) (\d+;\d+ ){1,}(\d+)$')
+multiple_whitespace = re.compile(r'\s\s+')
+
+# Parse the lines of a BRAT .ann file into annotation records (in file order).
+# The text of an annotation that contains linebreaks continues on the following lines
+# (one line per ';' in the indexes), so a record is yielded once all its lines are read.
+def parse_annotations( in_f ):
+    current = None
     split_lines_ahead = 0
     for line in in_f:
         line = line.rstrip('\n')
-        items = line.split('\t')
         if split_lines_ahead > 0:
             split_lines_ahead -= 1
-            last_item = annotations[-1]
-            new_tuple = (last_item[0],last_item[1],last_item[2],(last_item[3]+line),last_item[4])
-            annotations[-1] = new_tuple
+            current = current._replace(text=current.text + line)
             continue
+        items = line.split('\t')
         if len(items) == 3:
+            if current is not None:
+                yield current
             indexes_str = items[1]
-            if indexes_str.count(';') > 0:
-                split_lines_ahead += indexes_str.count(';')
+            split_lines_ahead = indexes_str.count(';')
             indexes_str = indexes_on_line_split.sub(' \\1 \\3', indexes_str)
             tag, start, end = indexes_str.split()
-            annotations.append( (tag, start, end, items[2], items[0]) )
-    seen = set()
-    removed_duplicates_annotations = []
-    for a, b, c, d, e in annotations:
-        if not b in seen:
-            seen.add(b)
-            removed_duplicates_annotations.append((a, b, c, d, e))
-        else:
-            for index, item in enumerate(removed_duplicates_annotations):
-                if item[1] == b and item[2] > c:
-                    tuple_without_n = (a, b, c, d, e)
-                    item = tuple_without_n
-                    removed_duplicates_annotations[index] = item
-                elif item[1] == b and item[2] < c:
-                    tuple_without_n = (a, b, item[2], d, e)
-                    item = tuple_without_n
-                    removed_duplicates_annotations[index] = item
-                else:
-                    continue
-    
-    for index, item in enumerate(removed_duplicates_annotations):
-        if "\xa0" in item[3]:
-            replaced = re.sub(r'\s\s+', r' ', item[3].replace(u'\xa0', u' '))
-            removed_duplicates_annotations[index] = ( item[0], item[1], item[2], replaced, item[4] )
-    
-    annotations = sorted(list(set(removed_duplicates_annotations)), key=lambda x: int(x[1]))
-    return annotations
\ No newline at end of file
+            current = BratAnnotation(tag, int(start), int(end), items[2], items[0])
+    if current is not None:
+        yield current
+
+# Collect the annotations of a BRAT .ann file, sorted by their start index.
+# Of the annotations that start at the same index, the shortest span is kept (with the
+# tag and text of the annotation that came last in the file).
+def collect_annotations( in_f ):
+    annotations_by_start = dict()
+    for annotation in parse_annotations(in_f):
+        previous = annotations_by_start.get(annotation.start)
+        if previous is not None:
+            if previous.end == annotation.end:
+                continue
+            if previous.end < annotation.end:
+                annotation = annotation._replace(end=previous.end)
+        annotations_by_start[annotation.start] = annotation
+
+    annotations = []
+    for start in sorted(annotations_by_start):
+        annotation = annotations_by_start[start]
+        if "\xa0" in annotation.text:
+            annotation = annotation._replace(text=multiple_whitespace.sub(' ', annotation.text.replace(u'\xa0', u' ')))
+        annotations.append(annotation)
+    return annotations
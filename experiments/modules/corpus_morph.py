@@ -0,0 +1,43 @@
+import time
+
+from estnltk.taggers import VabamorfCorpusTagger
+
+vm_corpus_tagger = None
+
+# Return a VabamorfCorpusTagger with the default settings (created once)
+def get_vm_corpus_tagger():
+    global vm_corpus_tagger
+    if vm_corpus_tagger is None:
+        vm_corpus_tagger = VabamorfCorpusTagger()
+    return vm_corpus_tagger
+
+# Split a list into batches of batch_size items
+def batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+# Replace the 'morph_analysis' layers of the preprocessed texts with the analyses of
+# VabamorfCorpusTagger. The texts are given to the tagger in batches of batch_size
+# documents: the corpus-based disambiguation uses the whole batch, and larger batches
+# need more memory. The layers are marked with the tagger in their meta (see
+# modules/feature_cache.py). The speed (documents per second) is printed for choosing the
+# batch size.
+# Output: the texts
+def tag_corpus_morph(texts, batch_size=100, tagger=None, verbose=True):
+    if tagger is None:
+        tagger = get_vm_corpus_tagger()
+
+    start = time.time()
+    for batch in batches(texts, batch_size):
+        for text in batch:
+            if 'morph_analysis' in text.layers:
+                text.pop_layer('morph_analysis')
+        tagger.tag(batch)
+        for text in batch:
+            text['morph_analysis'].meta['tagger'] = 'VabamorfCorpusTagger'
+    elapsed = time.time() - start
+
+    if verbose and texts:
+        print(f'(!) VabamorfCorpusTagger: {len(texts)} documents in {elapsed:.1f} seconds '
+              f'({len(texts) / max(elapsed, 1e-9):.1f} documents/sec, batch size {batch_size})')
+    return texts
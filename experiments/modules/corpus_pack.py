@@ -0,0 +1,139 @@
+import os
+import json
+
+import numpy as np
+
+from modules.span_reader import read_layer_spans
+
+# A columnar corpus pack stores the goldstandard corpus in a handful of files:
+#   text.bin            the UTF-8 encoded texts of all documents, one after another
+#   text_offsets.npy    byte offsets of the documents in text.bin (n_documents + 1)
+#   word_offsets.npy    start and end of every word (character offsets in its document)
+#   word_tags.npy       id of the gold_wordner tag (B-PER, I-PER, O, ...) of every word
+#   word_bounds.npy     index of the first word of every document (n_documents + 1)
+#   span_offsets.npy    start and end of every gold_ner span
+#   span_labels.npy     id of the gold_ner label (PER, LOC, ...) of every span
+#   span_bounds.npy     index of the first span of every document (n_documents + 1)
+#   meta.json           filenames, tag and label vocabularies
+# The arrays are loaded with memory-mapping, so reading them does not parse anything
+# and only the pages that are actually used are read from the disk.
+pack_format_version = 1
+
+# Export the goldstandard .json files into a columnar corpus pack
+def export_corpus_pack(json_files_location, filenames, pack_location):
+    if not os.path.exists(pack_location):
+        os.mkdir(pack_location)
+
+    tags = dict()
+    labels = dict()
+    text_offsets = [0]
+    word_offsets = []
+    word_tags = []
+    word_bounds = [0]
+    span_offsets = []
+    span_labels = []
+    span_bounds = [0]
+
+    with open(os.path.join(pack_location, 'text.bin'), 'wb') as out_text:
+        for file in filenames:
+            with open(os.path.join(json_files_location, file), 'r', encoding='UTF-8') as in_f:
+                data = json.load(in_f)
+
+            encoded = data['text'].encode('UTF-8')
+            out_text.write(encoded)
+            text_offsets.append(text_offsets[-1] + len(encoded))
+
+            for start, end, tag in read_layer_spans(data, 'gold_wordner'):
+                word_offsets.append((start, end))
+                word_tags.append(tags.setdefault(tag, len(tags)))
+            word_bounds.append(len(word_offsets))
+
+            for start, end, label in read_layer_spans(data, 'gold_ner'):
+                span_offsets.append((start, end))
+                span_labels.append(labels.setdefault(label, len(labels)))
+            span_bounds.append(len(span_offsets))
+
+    arrays = {
+        'text_offsets': np.array(text_offsets, dtype=np.int64),
+        'word_offsets': np.array(word_offsets, dtype=np.int32).reshape(-1, 2),
+        'word_tags': np.array(word_tags, dtype=np.uint8),
+        'word_bounds': np.array(word_bounds, dtype=np.int64),
+        'span_offsets': np.array(span_offsets, dtype=np.int32).reshape(-1, 2),
+        'span_labels': np.array(span_labels, dtype=np.uint8),
+        'span_bounds': np.array(span_bounds, dtype=np.int64)
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(pack_location, name + '.npy'), array)
+
+    meta = {
+        'version': pack_format_version,
+        'filenames': list(filenames),
+        'tags': sorted(tags, key=tags.get),
+        'labels': sorted(labels, key=labels.get)
+    }
+    with open(os.path.join(pack_location, 'meta.json'), 'w', encoding='UTF-8') as out_f:
+        json.dump(meta, out_f, ensure_ascii=False)
+
+    print(f'(!) Exported {len(filenames)} files to {pack_location}')
+
+# Reader of a columnar corpus pack. Documents can be referred to by their index or filename.
+class CorpusPack:
+
+    def __init__(self, pack_location):
+        with open(os.path.join(pack_location, 'meta.json'), 'r', encoding='UTF-8') as in_f:
+            meta = json.load(in_f)
+        if meta['version'] != pack_format_version:
+            raise ValueError(f'Unsupported corpus pack version {meta["version"]} in {pack_location}')
+
+        self.filenames = meta['filenames']
+        self.tags = meta['tags']
+        self.labels = meta['labels']
+        self.index = {file: i for i, file in enumerate(self.filenames)}
+
+        # np.memmap cannot map an empty file
+        text_file = os.path.join(pack_location, 'text.bin')
+        if os.path.getsize(text_file) > 0:
+            self.text_bytes = np.memmap(text_file, dtype=np.uint8, mode='r')
+        else:
+            self.text_bytes = np.zeros(0, dtype=np.uint8)
+
+        for name in ['text_offsets', 'word_offsets', 'word_tags', 'word_bounds',
+                     'span_offsets', 'span_labels', 'span_bounds']:
+            setattr(self, name, np.load(os.path.join(pack_location, name + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def _document(self, document):
+        return self.index[document] if isinstance(document, str) else document
+
+    # Return the text of a document
+    def text(self, document):
+        i = self._document(document)
+        return bytes(self.text_bytes[self.text_offsets[i]:self.text_offsets[i + 1]]).decode('UTF-8')
+
+    # Return the word offsets of a document (an array of shape (n_words, 2))
+    def words(self, document):
+        i = self._document(document)
+        return self.word_offsets[self.word_bounds[i]:self.word_bounds[i + 1]]
+
+    # Return the gold_wordner tag ids of a document (use self.tags to get the tag strings)
+    def word_tag_ids(self, document):
+        i = self._document(document)
+        return self.word_tags[self.word_bounds[i]:self.word_bounds[i + 1]]
+
+    # Return the gold_wordner tags of a document as strings
+    def word_tag_strings(self, document):
+        return [self.tags[tag] for tag in self.word_tag_ids(document)]
+
+    # Return the gold_ner spans of a document as arrays of offsets and label ids
+    def span_arrays(self, document):
+        i = self._document(document)
+        start, end = self.span_bounds[i], self.span_bounds[i + 1]
+        return self.span_offsets[start:end], self.span_labels[start:end]
+
+    # Return the gold_ner spans of a document in the format used by nervaluate
+    def gold_spans(self, document):
+        offsets, label_ids = self.span_arrays(document)
+        return [{"label": self.labels[label], "start": int(start), "end": int(end)}
+                for (start, end), label in zip(offsets.tolist(), label_ids.tolist())]
@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+
+from estnltk.converters import json_to_text, text_to_json
+
+from modules.span_reader import read_layer_spans
+
+# Parts of a protocol's filename, e.g. Harju_Hageri_Kohila_id10284_1868a.json
+filename_pattern = re.compile(r'^(?P<county>[^_]+)_(?P<parish>[^_]+)_(?P<commune>[^_]+)_id(?P<protocol_id>\d+)_(?P<year>\d{4})')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS documents (
+    filename TEXT PRIMARY KEY,
+    county TEXT,
+    parish TEXT,
+    commune TEXT,
+    protocol_id INTEGER,
+    year INTEGER,
+    subdistribution INTEGER,
+    json TEXT NOT NULL
+)
+'''
+
+# Return the county, parish, commune, protocol id and year of a protocol's filename
+def parse_filename(filename):
+    match = filename_pattern.match(filename)
+    if match is None:
+        return None, None, None, None, None
+    return match.group('county'), match.group('parish'), match.group('commune'), \
+           int(match.group('protocol_id')), int(match.group('year'))
+
+# Return the named entities of a layer of a document (.json contents) in the format used by nervaluate
+def document_ner_spans(document, layer_name):
+    return [{"label": label, "start": int(start), "end": int(end)}
+            for start, end, label in read_layer_spans(json.loads(document), layer_name)]
+
+# A single-file (SQLite) store of EstNLTK .json documents, keyed by the protocol's filename.
+# It replaces a directory of .json files, e.g. vallakohtufailid-json-flattened or a model's
+# vallakohtufailid-trained-nertagger directory.
+class DocumentStore:
+
+    def __init__(self, location):
+        self.location = location
+        self.connection = sqlite3.connect(location)
+        self.connection.execute(schema)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def __contains__(self, filename):
+        return self.connection.execute('SELECT 1 FROM documents WHERE filename = ?', (filename,)).fetchone() is not None
+
+    # Return the filenames of all documents (in the order they were added)
+    def filenames(self):
+        return [row[0] for row in self.connection.execute('SELECT filename FROM documents ORDER BY rowid')]
+
+    # Import all .json files of a directory in a single transaction.
+    # files: an optional dictionary {filename: subdistribution} (e.g. from divided_corpus.txt)
+    def import_directory(self, json_files_location, files=None):
+        rows = []
+        for file in sorted(os.listdir(json_files_location)):
+            if not file.endswith('.json'):
+                continue
+            with open(os.path.join(json_files_location, file), 'r', encoding='UTF-8') as in_f:
+                document = in_f.read()
+            subdistribution = int(files[file]) if files is not None and file in files else None
+            rows.append((file, *parse_filename(file), subdistribution, document))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        print(f'(!) Imported {len(rows)} files from {json_files_location}')
+
+    # Set the subdistributions of the documents
+    # files: a dictionary {filename: subdistribution}
+    def set_subdistributions(self, files):
+        with self.connection:
+            self.connection.executemany('UPDATE documents SET subdistribution = ? WHERE filename = ?',
+                                        [(int(subdistribution), file) for file, subdistribution in files.items()])
+
+    # Return the .json contents of a document
+    def get(self, filename):
+        row = self.connection.execute('SELECT json FROM documents WHERE filename = ?', (filename,)).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        return row[0]
+
+    # Return a document as an EstNLTK Text object
+    def get_text(self, filename):
+        return json_to_text(self.get(filename))
+
+    # Add or replace a document given as .json contents
+    def put(self, filename, document):
+        with self.connection:
+            self.connection.execute('''INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT(filename) DO UPDATE SET json = excluded.json''',
+                                    (filename, *parse_filename(filename), None, document))
+
+    # Add or replace a document given as an EstNLTK Text object
+    def put_text(self, filename, text):
+        self.put(filename, text_to_json(text))
+
+    # Iterate over (filename, .json contents) of the documents in a single query.
+    # filenames: only return these documents, in the given order (a filename that is not in
+    #   the store raises KeyError, like a missing .json file does)
+    # subdistributions: only return documents from these subdistributions
+    def iter_documents(self, filenames=None, subdistributions=None):
+        if subdistributions is not None:
+            subdistributions = {int(subdistribution) for subdistribution in subdistributions}
+
+        if filenames is None:
+            rows = self.connection.execute('SELECT filename, json, subdistribution FROM documents ORDER BY rowid')
+        else:
+            # The filenames are joined with the documents through a temporary table, so the
+            # documents come in the caller's order and the missing ones have no contents
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (position INTEGER PRIMARY KEY, filename TEXT)')
+            self.connection.execute('DELETE FROM temp.wanted')
+            self.connection.executemany('INSERT INTO temp.wanted VALUES (?, ?)', enumerate(filenames))
+            rows = self.connection.execute('SELECT wanted.filename, documents.json, documents.subdistribution '
+                                           'FROM temp.wanted LEFT JOIN documents ON documents.filename = wanted.filename '
+                                           'ORDER BY wanted.position')
+
+        for filename, document, subdistribution in rows:
+            if document is None:
+                raise KeyError(filename)
+            if subdistributions is None or subdistribution in subdistributions:
+                yield filename, document
+
+    # Iterate over (filename, Text object) of the documents (see iter_documents)
+    def iter_texts(self, filenames=None, subdistributions=None):
+        for filename, document in self.iter_documents(filenames, subdistributions):
+            yield filename, json_to_text(document)
+
+    # Return the named entities of a layer of a document in the format used by nervaluate
+    def ner_spans(self, filename, layer_name):
+        return document_ner_spans(self.get(filename), layer_name)
+
+    # Iterate over (filename, named entities of a layer) of the documents in a single query
+    # (see iter_documents)
+    def iter_ner_spans(self, layer_name, filenames=None, subdistributions=None):
+        for filename, document in self.iter_documents(filenames, subdistributions):
+            yield filename, document_ner_spans(document, layer_name)
+
+# Import a directory of .json files into a document store, e.g.:
+#   python -m modules.document_store ../data/vallakohtufailid-json-flattened ../data/vallakohtufailid-json-flattened.sqlite --divided-corpus ../data/divided_corpus.txt
+def main():
+    parser = argparse.ArgumentParser(description='Import a directory of .json files into a document store')
+    parser.add_argument('directory', help='directory with the .json files')
+    parser.add_argument('store', help='location of the SQLite document store')
+    parser.add_argument('--divided-corpus', help='file with the subdistributions of the files (e.g. divided_corpus.txt)')
+    args = parser.parse_args()
+
+    files = None
+    if args.divided_corpus is not None:
+        files = dict()
+        with open(args.divided_corpus, 'r', encoding='UTF-8') as in_f:
+            for line in in_f:
+                file, subdistribution = line.split(':')
+                files[file] = subdistribution.strip()
+
+    with DocumentStore(args.store) as store:
+        store.import_directory(args.directory, files)
+
+if __name__ == '__main__':
+    main()
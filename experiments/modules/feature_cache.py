@@ -0,0 +1,166 @@
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+
+import estnltk.taggers.estner.fex
+from estnltk.layer.layer import Layer
+
+import models.protocols_fex
+import models.gazetteer_index
+import models.gazetteer_variants
+import modules.template_compiler
+from modules.template_compiler import CompiledFeatureExtractor
+from modules.manual_morph import text_hash
+from modules.preprocessing_protocols import get_preprocessing_config_hash, estnltk_version
+
+# Location of the cache of extracted features (shared by all notebooks)
+feature_cache_location = os.path.join('..', 'data', 'feature_cache.sqlite')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS features (
+    document_hash TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    sequences BLOB NOT NULL,
+    PRIMARY KEY (document_hash, config_hash)
+)
+'''
+
+# The modules whose code the CRF attributes depend on: the feature extractors, the gazetteer
+# lookup, the template compiler and EstNLTK's feature functions
+feature_modules = [models.protocols_fex, models.gazetteer_index, models.gazetteer_variants,
+                   modules.template_compiler, estnltk.taggers.estner.fex]
+
+file_hashes = dict()
+
+# Return the hash of the contents of a file (computed once per path and mtime)
+def file_hash(path):
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in file_hashes:
+        with open(path, 'rb') as f:
+            file_hashes[key] = hashlib.sha256(f.read()).hexdigest()
+    return file_hashes[key]
+
+# Return the hash of the settings that the CRF attributes depend on: the feature extractors,
+# the templates, the gazetteer file, the layers the extractors read, the code of the
+# feature_modules and EstNLTK's version. The CRFSUITE_*
+# settings are left out, so the models that differ only by them share the features.
+def get_feature_config_hash(settings, input_layers):
+    gazetteer_file = getattr(settings, 'GAZETTEER_FILE', None)
+    config = {
+        'feature_extractors': list(settings.FEATURE_EXTRACTORS),
+        'fused_feature_extractors': list(getattr(settings, 'FUSED_FEATURE_EXTRACTORS', ())),
+        'templates': [[list(item) for item in template] for template in settings.TEMPLATES],
+        'deduplicate_templates': getattr(settings, 'DEDUPLICATE_TEMPLATES', False),
+        'gazetteer_lookup': getattr(settings, 'GAZETTEER_LOOKUP', 'exact'),
+        'gazetteer': file_hash(gazetteer_file) if gazetteer_file and os.path.exists(gazetteer_file) else None,
+        'input_layers': list(input_layers),
+        'modules': {module.__name__: file_hash(module.__file__) for module in feature_modules},
+        'estnltk': estnltk_version
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('UTF-8')).hexdigest()
+
+# Return the hash of a document: the hash of its text, the hash of the preprocessing settings
+# (see modules/preprocessing_protocols.py) and the meta of the morphological layer, which tells
+# the analyses of VabamorfCorpusTagger and the manual analyses apart from Vabamorf's
+def document_hash(text, morph_layer, preprocessing_config_hash):
+    meta = text[morph_layer].meta if morph_layer in text.layers else {}
+    document = text_hash(text.text) + preprocessing_config_hash + json.dumps(meta, sort_keys=True)
+    return hashlib.sha256(document.encode('UTF-8')).hexdigest()
+
+# A single-file (SQLite) cache of the CRF attributes of the documents (the 'F' attribute of the
+# 'ner_features' layer sentence by sentence), keyed by the hash of the document and the hash of
+# the feature settings. The attributes are stored as zlib-compressed JSON. Several processes
+# can use the same cache file.
+class FeatureCache:
+
+    def __init__(self, location=feature_cache_location):
+        self.location = location
+        self.connection = sqlite3.connect(location, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(schema)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    # Output: the CRF attributes of the tokens of each sentence or None if the document is not in the cache
+    def get(self, document_hash, config_hash):
+        row = self.connection.execute('SELECT sequences FROM features WHERE document_hash = ? AND config_hash = ?',
+                                      (document_hash, config_hash)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('UTF-8'))
+
+    def put(self, document_hash, config_hash, sequences):
+        data = zlib.compress(json.dumps(sequences, ensure_ascii=False).encode('UTF-8'))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO features VALUES (?, ?, ?)',
+                                    (document_hash, config_hash, data))
+
+    # Remove the entries that were made with other feature settings
+    def remove_outdated(self, config_hash):
+        with self.connection:
+            self.connection.execute('DELETE FROM features WHERE config_hash != ?', (config_hash,))
+        self.connection.execute('VACUUM')
+
+feature_cache = None
+feature_cache_pid = None
+
+# Return the cache at feature_cache_location (opened once per process, as SQLite connections
+# cannot be shared with worker processes). Without the data directory (or with
+# feature_cache_location set to None) no cache is used.
+def get_feature_cache():
+    global feature_cache, feature_cache_pid
+    if feature_cache_location is None or not os.path.isdir(os.path.dirname(feature_cache_location) or '.'):
+        return None
+    if feature_cache is None or feature_cache_pid != os.getpid() or feature_cache.location != feature_cache_location:
+        feature_cache = FeatureCache(feature_cache_location)
+        feature_cache_pid = os.getpid()
+    return feature_cache
+
+class CachedFeatureExtractor(CompiledFeatureExtractor):
+    """CompiledFeatureExtractor that keeps the CRF attributes of the documents in the feature
+    cache. For a document in the cache, only a 'ner_features' layer with the 'F' attribute
+    (which is all that the CRF reads) is created and the feature extractors are not run.
+    """
+
+    def __init__(self, settings, morph_layer_inputs):
+        super().__init__(settings, morph_layer_inputs)
+        self.config_hash = get_feature_config_hash(settings, morph_layer_inputs)
+        self.preprocessing_config_hash = get_preprocessing_config_hash()
+
+    def process(self, docs):
+        cache = get_feature_cache()
+        if cache is None:
+            super().process(docs)
+            return
+
+        sentences_layer = self.morph_layer_inputs[2]
+        missing = []
+        for doc in docs:
+            key = document_hash(doc, self.morph_layer_inputs[0], self.preprocessing_config_hash)
+            sequences = cache.get(key, self.config_hash)
+            if sequences is None:
+                missing.append((doc, key))
+                continue
+            layer = Layer('ner_features', attributes=('F',), text_object=doc, ambiguous=True)
+            for word, attributes in zip(doc[self.morph_layer_inputs[1]],
+                                        (attributes for sentence in sequences for attributes in sentence)):
+                layer.add_annotation(word, F=attributes)
+            doc.add_layer(layer)
+
+        super().process([doc for doc, key in missing])
+        for doc, key in missing:
+            cache.put(key, self.config_hash, [[list(token.ner_features.F[0]) for token in sentence]
+                                              for sentence in doc[sentences_layer]])
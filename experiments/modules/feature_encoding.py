@@ -0,0 +1,165 @@
+import os
+import zlib
+from array import array
+from collections import namedtuple
+
+import pycrfsuite
+from estnltk import Text
+from estnltk.taggers.estner.model_storage_util import ModelStorageUtil
+
+from modules.template_compiler import CompiledTemplatesNerTagger
+
+# Name of the feature dictionary in the model directory
+feature_dictionary_file = 'feature_dictionary.txt'
+
+# The CRF attributes of a sentence as ids: the ids of all tokens in one array, and the start
+# of each token's ids (the ids of token i are ids[offsets[i]:offsets[i + 1]])
+EncodedSentence = namedtuple('EncodedSentence', ['ids', 'offsets'])
+
+# Interns the CRF attributes (e.g. 'lem[0]|lem[-1]=jaan|kohus') into integer ids. With buckets,
+# the attributes are hashed into a fixed number of ids and nothing needs to be stored;
+# otherwise the ids are given in the order in which the attributes are seen.
+class FeatureDictionary:
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self.ids = dict()
+        self.features = []
+
+    def __len__(self):
+        return self.buckets if self.buckets else len(self.features)
+
+    # Return the id of the attribute
+    # grow: add an unknown attribute to the dictionary (when training); otherwise return None
+    def encode(self, feature, grow=True):
+        if self.buckets:
+            return zlib.crc32(feature.encode('UTF-8')) % self.buckets
+        feature_id = self.ids.get(feature)
+        if feature_id is None and grow:
+            feature_id = len(self.features)
+            self.ids[feature] = feature_id
+            self.features.append(feature)
+        return feature_id
+
+    # The first line has the number of buckets (0 if not hashed), then one attribute per line
+    def save(self, path):
+        with open(path, 'w', encoding='UTF-8') as f:
+            f.write('{}\n'.format(self.buckets or 0))
+            for feature in self.features:
+                f.write(feature + '\n')
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='UTF-8') as f:
+            dictionary = cls(int(f.readline()) or None)
+            for line in f:
+                dictionary.encode(line.rstrip('\n'))
+        return dictionary
+
+# Encode the CRF attributes of the tokens of a sentence (lists of strings)
+# Unknown attributes are left out if grow is False.
+def encode_sentence(token_features, dictionary, grow=True):
+    ids = array('I')
+    offsets = array('I', [0])
+    for features in token_features:
+        for feature in features:
+            feature_id = dictionary.encode(feature, grow)
+            if feature_id is not None:
+                ids.append(feature_id)
+        offsets.append(len(ids))
+    return EncodedSentence(ids, offsets)
+
+# Encode the CRF attributes ('F' of the 'ner_features' layer) of a text sentence by sentence
+# Output: a list of EncodedSentence
+def encode_text(text, dictionary, sentences_layer='sentences', grow=True):
+    return [encode_sentence([token.ner_features.F[0] for token in sentence], dictionary, grow)
+            for sentence in text[sentences_layer]]
+
+# Return the item sequence of an encoded sentence for crfsuite. crfsuite only takes attribute
+# names as strings, so each id is named by its decimal string; crfsuite turns the names back
+# into its own integer ids when the sentence is appended or tagged.
+def sentence_items(sentence):
+    ids, offsets = sentence
+    return [[str(feature_id) for feature_id in ids[offsets[i]:offsets[i + 1]]] for i in range(len(offsets) - 1)]
+
+# Return the NER labels of the texts sentence by sentence (as NerTrainer takes them from the layer)
+def text_labels(text, layer, sentences_layer='sentences'):
+    if layer not in text.layers:
+        raise Exception("Error in text: missing NER layer {!r}.".format(layer))
+    labels = []
+    tags = list(text[layer].nertag)
+    start = 0
+    for sentence in text[sentences_layer]:
+        labels.append(tags[start:start + len(sentence)])
+        start += len(sentence)
+    return labels
+
+# Extract the CRF attributes of the training texts and encode them as ids, text by text: the
+# features of a text are removed before the next text is processed, so only the arrays of ids
+# are kept. The encoded sentences can be kept and used for training several models (e.g. the
+# folds of a cross-validation, see notebook 03) without extracting the features again.
+# trainer: a NerTrainer (for the feature extractor)
+# Output: a list of tuples (EncodedSentence, labels), one for each sentence
+def encode_training_texts(trainer, texts, dictionary, labels=None, layer='wordner'):
+    if isinstance(texts, Text):
+        texts = [texts]
+    sentences_layer = trainer.input_layers[2]
+    encoded_sentences = []
+    for i, text in enumerate(texts):
+        sentence_labels = labels[i] if labels is not None else text_labels(text, layer, sentences_layer)
+        trainer.fex.process([text])
+        encoded_sentences.extend(zip(encode_text(text, dictionary, sentences_layer), sentence_labels))
+        text.pop_layer('ner_features')
+    return encoded_sentences
+
+# Train a model like NerTrainer.train from the encoded sentences (see encode_training_texts).
+# The feature dictionary is saved in the model directory (NerTagger cannot read the model,
+# use EncodedNerTagger).
+# trainer: a NerTrainer (for the settings)
+# encoded_sentences: tuples (EncodedSentence, labels)
+def train_encoded(trainer, encoded_sentences, dictionary, model_dir='ner_model', verbose=True):
+    model_util = ModelStorageUtil(model_dir)
+    model_util.makedir()
+    model_util.copy_settings(trainer.settings)
+
+    crf_trainer = pycrfsuite.Trainer(algorithm=trainer.settings.CRFSUITE_ALGORITHM,
+                                     params={'c2': trainer.settings.CRFSUITE_C2}, verbose=verbose)
+    for sentence, sentence_labels in encoded_sentences:
+        crf_trainer.append(sentence_items(sentence), sentence_labels)
+
+    dictionary.save(os.path.join(model_dir, feature_dictionary_file))
+    crf_trainer.train(model_util.model_filename)
+
+# Tags the sentences of a text with a model trained by train_encoded (used as the crf_model of
+# EncodedNerTagger)
+class EncodedCrfsuiteModel:
+
+    def __init__(self, model_filename, dictionary):
+        self.tagger = pycrfsuite.Tagger()
+        self.tagger.open(model_filename)
+        self.dictionary = dictionary
+
+    def tag(self, text, layers=('morph_analysis', 'words', 'sentences')):
+        return [self.tagger.tag(sentence_items(sentence))
+                for sentence in encode_text(text, self.dictionary, layers[2], grow=False)]
+
+
+class EncodedNerTagger(CompiledTemplatesNerTagger):
+    """NerTagger for the models trained with train_encoded: the CRF attributes are looked up in
+    the model's feature dictionary before tagging.
+    """
+
+    def __init__(self, model_dir, **kwargs):
+        super().__init__(model_dir, **kwargs)
+        dictionary = FeatureDictionary.load(os.path.join(model_dir, feature_dictionary_file))
+        self.crf_model = EncodedCrfsuiteModel(self.modelUtil.model_filename, dictionary)
+
+# Return True if the model in model_dir was trained with train_encoded
+def is_encoded_model(model_dir):
+    return os.path.exists(os.path.join(model_dir, feature_dictionary_file))
+
+# Remove the feature dictionary of an earlier train_encoded from model_dir (before training the
+# model without encoding, so that it is not tagged with EncodedNerTagger)
+def remove_feature_dictionary(model_dir):
+    if is_encoded_model(model_dir):
+        os.remove(os.path.join(model_dir, feature_dictionary_file))
@@ -1,8 +1,42 @@
 import re
+import json
 
+multiple_whitespace = re.compile(r'\s\s+')
+
+# Normalise the whitespace of an annotated string
+def normalise(string):
+    return multiple_whitespace.sub(' ', string.strip())
+
+# Group the offsets of annotations by their normalised string
+# Input: tuples (string, start, end)
+def group_by_string(annotations):
+    grouped = dict()
+    for string, start, end in annotations:
+        grouped.setdefault(normalise(string), []).append([int(start), int(end)])
+    return grouped
+
+# Find the difference between the annotations in the BRAT file and the annotations on the text
+# Output: None if the annotated strings are the same, otherwise a report
+#   {'file': ..., 'missing': [...], 'spurious': [...]}
+# where 'missing' lists the BRAT annotations (with BRAT offsets) that are not on the text and
+# 'spurious' lists the annotations on the text (with text offsets) that are not in the BRAT file
 def find_difference(file, brat_annotations, text_goldner):
-    set1 = [re.sub(r'\s\s+', r' ', element[3].strip()) for element in brat_annotations]
-    set2 = [re.sub(r'\s\s+', r' ', element.enclosing_text.strip()) for element in text_goldner]
-    diff = list(list(set(set1)-set(set2)) + list(set(set2)-set(set1)))
-    if (diff):
-        print(f"(!) Difference in {file} correct annotations and output annotations: {diff}")
\ No newline at end of file
+    gold = group_by_string((element.text, element.start, element.end) for element in brat_annotations)
+    output = group_by_string((element.enclosing_text, element.start, element.end) for element in text_goldner)
+
+    missing = sorted(gold.keys() - output.keys())
+    spurious = sorted(output.keys() - gold.keys())
+    if not missing and not spurious:
+        return None
+
+    return {
+        'file': file,
+        'missing': [{'text': string, 'offsets': gold[string]} for string in missing],
+        'spurious': [{'text': string, 'offsets': output[string]} for string in spurious]
+    }
+
+# Write the difference reports of all documents into one JSONL file (one report per line)
+def write_difference_report(reports, report_file):
+    with open(report_file, 'w', encoding='UTF-8') as out_f:
+        for report in sorted(reports, key=lambda report: report['file']):
+            out_f.write(json.dumps(report, ensure_ascii=False) + '\n')
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+
+from estnltk.layer.layer import Layer
+
+# Location of the hand-analysed protocols: the .txt and .ann files of the protocols and, in
+# morf_analyysid, a .tsv file of manual morphological analyses for every protocol
+manual_morph_location = os.path.join('..', 'data', 'vallakohtufailid-manual-morph-analysis')
+
+# The manual analyses compiled into a single file, keyed by the hash of the protocol's text
+manual_morph_cache_location = os.path.join(manual_morph_location, 'manual_morph_cache.json')
+
+morph_attributes = ('normalized_text', 'lemma', 'root', 'root_tokens', 'ending', 'clitic', 'form', 'partofspeech')
+
+protocol_id_pattern = re.compile(r'^(?P<county>[^_]+)_.*_id(?P<protocol_id>\d+)_')
+
+# Characters written as their code points in the .tsv files, e.g. <U+2116> for '№'
+code_point_pattern = re.compile(r'<U\+(?P<code>[0-9A-Fa-f]{4,6})>')
+
+# How far after the previous token a token of the .tsv file is looked for in the text
+max_token_gap = 300
+
+# The number of hand-analysed texts that got the manual analyses ('used') and that fell back
+# to Vabamorf because a word had no manual analysis ('unaligned'), and the number of .tsv
+# tokens that were not found in the text ('skipped_tokens')
+manual_morph_statistics = Counter()
+
+# Return the hash of a protocol's text
+def text_hash(text):
+    return hashlib.sha256(text.encode('UTF-8')).hexdigest()
+
+# Normalise a protocol's text before looking up its manual analyses: the .txt files of
+# the corpus contain no-break spaces, which the .json files and notebooks may or may not have
+def normalise_text(text):
+    return text.replace(u'\xa0', ' ')
+
+# Return the key of a protocol in the manual analyses cache
+def manual_morph_key(text):
+    return text_hash(normalise_text(text.text))
+
+# Undo the escaping of a field of a .tsv file: the fields with quotes are quoted as in CSV
+# (e.g. '""""' for '"') and some characters are written as <U+...>
+def unescape_field(field):
+    if len(field) >= 2 and field.startswith('"') and field.endswith('"'):
+        field = field[1:-1].replace('""', '"')
+    return code_point_pattern.sub(lambda match: chr(int(match.group('code'), 16)), field)
+
+# Read the manual analyses of a protocol from a .tsv file.
+# Every token starts on a line with the word in the first column; the following lines
+# (with an empty first column) are its other possible analyses. The columns are:
+# word, normalized form, root, ending, clitic, part of speech, form. The chosen analysis
+# is marked with '@', '#' or '£' in front of the normalized form; if none is marked, the
+# first one is used. Unanalysed variants are marked with '####'. A token can span several
+# words of the text (e.g. 'H. Saarmo', '1873.' or 'wersta-posti').
+# Output: a list of tokens [word, normalized form, root, ending, clitic, part of speech, form]
+def read_manual_analyses(tsv_file):
+    tokens = []
+    analyses = []
+
+    def choose_analysis():
+        candidates = [analysis for analysis in analyses if analysis[0] != '####']
+        chosen = [analysis for analysis in candidates if analysis[0][:1] in ('@', '#', '£')]
+        analysis = (chosen or candidates or [[tokens[-1][0], tokens[-1][0], '', '', '', '']])[0]
+        tokens[-1][1:] = [analysis[0].lstrip('@#£')] + analysis[1:]
+
+    with open(tsv_file, 'r', encoding='UTF-8') as in_f:
+        for line in in_f:
+            items = line.rstrip('\n').split('\t')
+            if len(items) < 2:
+                continue
+            items = [unescape_field(item) for item in (items + [''] * 7)[:7]]
+            if items[0].strip():
+                if tokens:
+                    choose_analysis()
+                tokens.append([items[0]])
+                analyses = []
+            elif not tokens:
+                continue
+            analyses.append(items[1:])
+    if tokens:
+        choose_analysis()
+    return tokens
+
+# Find the .tsv file of a protocol (e.g. Harju_id12761_corr_parandatud.tsv for
+# Harju_Kose_Kose-Uuem6isa_id12761_1870a.txt)
+def find_tsv_file(filename, tsv_files):
+    match = protocol_id_pattern.match(filename)
+    if match is None:
+        return None
+    prefix = f"{match.group('county')}_id{match.group('protocol_id')}_"
+    for tsv_file in tsv_files:
+        if tsv_file.startswith(prefix):
+            return tsv_file
+    return None
+
+# Compile the manual analyses of all hand-analysed protocols into the cache file
+def build_manual_morph_cache(location=manual_morph_location, cache_location=manual_morph_cache_location):
+    tsv_location = os.path.join(location, 'morf_analyysid')
+    tsv_files = sorted(file for file in os.listdir(tsv_location) if file.endswith('.tsv'))
+
+    cache = dict()
+    for file in sorted(os.listdir(location)):
+        if not file.endswith('.txt'):
+            continue
+        tsv_file = find_tsv_file(file, tsv_files)
+        if tsv_file is None:
+            print(f'(!) No manual analyses for {file}')
+            continue
+        with open(os.path.join(location, file), 'r', encoding='UTF-8') as in_f:
+            text = normalise_text(in_f.read())
+        cache[text_hash(text)] = {'file': file, 'tokens': read_manual_analyses(os.path.join(tsv_location, tsv_file))}
+
+    with open(cache_location, 'w', encoding='UTF-8') as out_f:
+        json.dump(cache, out_f, ensure_ascii=False)
+    print(f'(!) Manual analyses of {len(cache)} protocols saved to {cache_location}')
+
+manual_morph_cache = None
+
+# Load the cache file (once). Without a cache file no manual analyses are used.
+def load_manual_morph_cache(cache_location=manual_morph_cache_location):
+    global manual_morph_cache
+    if manual_morph_cache is None:
+        if os.path.exists(cache_location):
+            with open(cache_location, 'r', encoding='UTF-8') as in_f:
+                manual_morph_cache = json.load(in_f)
+        else:
+            manual_morph_cache = dict()
+    return manual_morph_cache
+
+# Return the hash of the cache file (None without a cache file), so that the settings that
+# use the manual analyses change when the analyses change
+def manual_morph_cache_hash(cache_location=manual_morph_cache_location):
+    if not os.path.exists(cache_location):
+        return None
+    with open(cache_location, 'rb') as in_f:
+        return hashlib.sha256(in_f.read()).hexdigest()
+
+# Return True if the text is one of the hand-analysed protocols
+def is_manually_analysed(text):
+    return manual_morph_key(text) in load_manual_morph_cache()
+
+# Return the lemma of a root (as EstNLTK forms it from Vabamorf's output)
+def root_to_lemma(root, partofspeech):
+    lemma = root.replace('_', '').replace('=', '').replace('+', '')
+    if partofspeech == 'V' and lemma not in ('ei', 'ära', 'ep', 'ega'):
+        lemma += 'ma'
+    return lemma
+
+# Find the tokens of the .tsv file in the text in order
+# Output: a list of (start, end, token) of the tokens that were found; the whitespace
+# between the words of a token may differ from the text
+def align_tokens(text, tokens):
+    aligned = []
+    position = 0
+    for token in tokens:
+        pattern = r'\s+'.join(re.escape(part) for part in token[0].split())
+        match = re.compile(pattern).search(text, position, position + max_token_gap + len(token[0])) if pattern else None
+        if match is None:
+            manual_morph_statistics['skipped_tokens'] += 1
+            continue
+        aligned.append((match.start(), match.end(), token))
+        position = match.end()
+    return aligned
+
+# Create a 'morph_analysis' layer from the manual analyses of the protocol.
+# The tokens of the .tsv file are aligned with the text by their character offsets and each
+# word gets the analysis of the first token that overlaps it, so a token can cover several
+# words (these get the word itself as their normalized form); tokens that are not in the text
+# are skipped. The layer is marked as manual in its meta.
+# Output: the layer or None if the text is not hand-analysed or a word has no analysis (the
+# texts that fall back to Vabamorf are counted in manual_morph_statistics)
+def manual_morph_layer(text):
+    entry = load_manual_morph_cache().get(manual_morph_key(text))
+    if entry is None:
+        return None
+
+    aligned = align_tokens(normalise_text(text.text), entry['tokens'])
+    analyses = []
+    i = 0
+    for word in text.words:
+        while i < len(aligned) and aligned[i][1] <= word.start:
+            i += 1
+        if i == len(aligned) or aligned[i][0] >= word.end:
+            manual_morph_statistics['unaligned'] += 1
+            print(f"(!) No manual analysis for the word {word.text!r} at {word.start} in {entry['file']}, using Vabamorf")
+            return None
+        start, end, token = aligned[i]
+        if start < word.start or end > word.end:
+            token = [word.text, word.text] + token[2:]
+        analyses.append(token)
+
+    layer = Layer('morph_analysis', attributes=morph_attributes, text_object=text, parent='words', ambiguous=True)
+    layer.meta['tagger'] = 'manual'
+    for word, (_, normalized, root, ending, clitic, partofspeech, form) in zip(text.words, analyses):
+        layer.add_annotation(word.base_span,
+                             normalized_text=normalized,
+                             lemma=root_to_lemma(root, partofspeech),
+                             root=root,
+                             root_tokens=[token.replace('=', '').replace('+', '') for token in root.split('_')],
+                             ending=ending,
+                             clitic=clitic,
+                             form=form,
+                             partofspeech=partofspeech)
+    manual_morph_statistics['used'] += 1
+    return layer
+
+if __name__ == '__main__':
+    build_manual_morph_cache()
@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+
+from estnltk.vabamorf.morf import Vabamorf
+
+# Copy an analysis, so that changes made by the taggers do not reach the cache
+def copy_analysis(analysis):
+    return {key: list(value) if isinstance(value, list) else value for key, value in analysis.items()}
+
+# A lowercase word put before a word that is analysed without context (see context_key)
+neutral_word = 'ja'
+
+# Marks a context that starts at the beginning of the sentence
+sentence_start = None
+
+# Return the context of the word at position i of a sentence that changes Vabamorf's analysis
+# when guessing or proper name analysis is on: a capitalised word is analysed differently at the
+# start of the sentence and after punctuation (e.g. ': Kui' or '1 ) Astus'). Other words are
+# analysed the same way everywhere (checked on all protocols of the corpus).
+# Output: None (no context) or the (at most two) preceding tokens, after sentence_start if the
+# context reaches the start of the sentence
+def context_key(words, i):
+    if i == 0:
+        return (sentence_start,)
+    if words[i][:1].isupper() and not any(character.isalnum() for character in words[i - 1]):
+        return ((sentence_start,) if i <= 2 else ()) + tuple(words[max(0, i - 2):i])
+    return None
+
+class MemoisedVabamorf(Vabamorf):
+    """Wraps a Vabamorf instance and keeps the analyses (without disambiguation) of the word
+    forms in a bounded LRU cache. With guessing or proper name analysis (both on by default in
+    VabamorfTagger), a word form is cached together with its context (see context_key), so a
+    capitalised word at the start of a sentence or after punctuation has its own entry. The
+    word forms of a sentence that are not in the cache are analysed with one Vabamorf call,
+    each in its own context. Disambiguation and the other methods are passed on to the wrapped
+    Vabamorf. Use it as the vm_instance of VabamorfTagger.
+    """
+
+    def __init__(self, vm_instance=None, max_size=200000):
+        # The lexicons are not loaded again: the wrapped instance does the analysis
+        self.vm_instance = vm_instance if vm_instance is not None else Vabamorf.instance()
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.analyse_time = 0.0
+
+    # Attributes of Vabamorf (e.g. the _morf used by disambiguate) come from the wrapped instance
+    def __getattr__(self, name):
+        if name == 'vm_instance':
+            raise AttributeError(name)
+        return getattr(self.vm_instance, name)
+
+    def disambiguate(self, words):
+        return self.vm_instance.disambiguate(words)
+
+    def analyze(self, words, **kwargs):
+        if kwargs.get('disambiguate', True):
+            return self.vm_instance.analyze(words, **kwargs)
+
+        options = tuple(sorted(kwargs.items()))
+        words = list(words)
+        contextual = kwargs.get('guess', True) or kwargs.get('propername', True)
+        keys = [(word, context_key(words, i) if contextual else None, options) for i, word in enumerate(words)]
+
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        missed = sum(1 for key in keys if key not in self.cache)
+        self.misses += missed
+        self.hits += len(keys) - missed
+        if missing:
+            for key, analyses in zip(missing, self._analyse_in_context(missing, kwargs, contextual)):
+                self.cache[key] = analyses
+        for key in keys:
+            self.cache.move_to_end(key)
+
+        results = [{'text': word, 'analysis': [copy_analysis(analysis) for analysis in self.cache[key]]}
+                   for word, key in zip(words, keys)]
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return results
+
+    # Analyse the word forms of the cache keys, each in its context: the words are put in one
+    # sentence after their preceding tokens (or after neutral_word); the words whose context
+    # reaches the start of the sentence are analysed in sentences of their own
+    # Output: the list of analyses of each key
+    def _analyse_in_context(self, keys, kwargs, contextual):
+        sentence = []
+        positions = []
+        for word, context, _ in keys:
+            if context is not None and context[0] is sentence_start:
+                positions.append(None)
+                continue
+            if contextual:
+                sentence.extend(context if context is not None else [neutral_word])
+            positions.append(len(sentence))
+            sentence.append(word)
+
+        analysed = self._analyse(sentence, kwargs) if sentence else []
+        return [analysed[position] if position is not None else self._analyse(list(context[1:]) + [word], kwargs)[-1]
+                for (word, context, _), position in zip(keys, positions)]
+
+    # Analyse the words with the wrapped Vabamorf
+    # Output: the list of analyses of each word
+    def _analyse(self, words, kwargs):
+        start = time.time()
+        analysed = self.vm_instance.analyze(words, **kwargs)
+        self.analyse_time += time.time() - start
+        return [[copy_analysis(analysis) for analysis in result['analysis']] for result in analysed]
+
+    # Return the hit rate (of the words) and timing statistics of the cache
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'cached_entries': len(self.cache),
+            'analyse_time': self.analyse_time
+        }
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.analyse_time = 0.0
@@ -0,0 +1,112 @@
+from collections import namedtuple
+
+from estnltk.taggers.estner.ner_trainer import NerTrainer
+from estnltk.taggers.estner.model_storage_util import ModelStorageUtil
+
+from models.protocols_fex import default_fused_feature_extractors
+from modules.feature_encoding import EncodedNerTagger, is_encoded_model
+from modules.template_compiler import CompiledFeatureExtractor, CompiledTemplatesNerTagger, use_compiled_templates
+from modules.feature_cache import CachedFeatureExtractor
+
+# Layers that every model needs: NerTagger and NerTrainer work sentence by sentence
+base_layers = ['tokens', 'compound_tokens', 'words', 'sentences']
+
+# What the feature extractors read besides the words: the 'morph_analysis' layer and/or
+# the gazetteer file. Extractors that are not listed here are assumed to need everything.
+extractor_requirements = {
+    'models.protocols_fex.NerEmptyFeatureTagger': set(),
+    'models.protocols_fex.NerLocalFeatureWithoutMorphTagger': set(),
+    'models.protocols_fex.NerBasicMorphFeatureTagger': {'morph_analysis'},
+    'models.protocols_fex.NerMorphNoLemmasFeatureTagger': {'morph_analysis'},
+    'models.protocols_fex.NerGazetteerFeatureTagger': {'gazetteer'},
+    'estnltk.taggers.estner.fex.NerMorphFeatureTagger': {'morph_analysis'},
+    'estnltk.taggers.estner.fex.NerLocalFeatureTagger': {'morph_analysis'},
+    'estnltk.taggers.estner.fex.NerSentenceFeatureTagger': set(),
+    'estnltk.taggers.estner.fex.NerGazetteerFeatureTagger': {'morph_analysis', 'gazetteer'},
+    'estnltk.taggers.estner.fex.NerGlobalContextFeatureTagger': {'morph_analysis'}
+}
+all_requirements = {'morph_analysis', 'gazetteer'}
+
+# Feature attributes that come from the gazetteer
+gazetteer_attributes = {'gaz', 'pgaz', 'ngaz'}
+
+# Feature extractors that load the gazetteer
+gazetteer_extractors = {'models.protocols_fex.NerGazetteerFeatureTagger',
+                        'estnltk.taggers.estner.fex.NerGazetteerFeatureTagger'}
+
+# layers: the layers that have to be created by preprocess_text
+# morph_layer_input: the layer that NerTagger and NerTrainer get as their morphological
+#   analysis layer ('words' if the model does not use morphology)
+# gazetteer: True if the model's templates use the gazetteer features
+PipelinePlan = namedtuple('PipelinePlan', ['layers', 'morph_layer_input', 'gazetteer'])
+
+# Return the feature attributes that are used by the feature templates
+def template_attributes(templates):
+    return {attribute for template in templates for attribute, offset in template}
+
+# Work out which layers a model needs from its FEATURE_EXTRACTORS and TEMPLATES settings
+def plan_pipeline(settings):
+    extractors = []
+    for extractor in settings.FEATURE_EXTRACTORS:
+        # NerFusedFeatureTagger needs what the extractors it replaces need
+        if extractor == 'models.protocols_fex.NerFusedFeatureTagger':
+            extractors.extend(getattr(settings, 'FUSED_FEATURE_EXTRACTORS', default_fused_feature_extractors))
+        else:
+            extractors.append(extractor)
+
+    requirements = set()
+    for extractor in extractors:
+        requirements |= extractor_requirements.get(extractor, all_requirements)
+
+    layers = list(base_layers)
+    if 'morph_analysis' in requirements:
+        layers.append('morph_analysis')
+    gazetteer = 'gazetteer' in requirements and bool(gazetteer_attributes & template_attributes(settings.TEMPLATES))
+    return PipelinePlan(layers, 'morph_analysis' if 'morph_analysis' in requirements else 'words', gazetteer)
+
+# The settings of a model as its feature extractors see them: without the gazetteer feature
+# extractors if the model's templates do not use the gazetteer features, so the gazetteer is
+# not loaded. The other settings come from the settings module.
+class PlannedSettings:
+
+    def __init__(self, settings, plan):
+        self.settings = settings
+        self.FEATURE_EXTRACTORS = tuple(extractor for extractor in settings.FEATURE_EXTRACTORS
+                                        if plan.gazetteer or extractor not in gazetteer_extractors)
+
+    def __getattr__(self, name):
+        if name == 'settings':
+            raise AttributeError(name)
+        return getattr(self.settings, name)
+
+# Return the plan of the model in model_dir (see plan_pipeline)
+def plan_model_pipeline(model_dir):
+    return plan_pipeline(ModelStorageUtil(model_dir).load_settings())
+
+# Return a NerTagger of the model that reads only the layers of the plan, runs only the feature
+# extractors the templates need (see PlannedSettings) and applies the compiled feature
+# templates (an EncodedNerTagger if the model was trained with feature_encoding.train_encoded)
+# use_feature_cache: read the features of the documents from the feature cache (see modules/feature_cache.py)
+def create_ner_tagger(model_dir, plan=None, use_feature_cache=True):
+    settings = ModelStorageUtil(model_dir).load_settings()
+    if plan is None:
+        plan = plan_pipeline(settings)
+    feature_extractor = CachedFeatureExtractor if use_feature_cache else CompiledFeatureExtractor
+    tagger_class = EncodedNerTagger if is_encoded_model(model_dir) else CompiledTemplatesNerTagger
+    return tagger_class(model_dir, feature_extractor=feature_extractor, nersettings=PlannedSettings(settings, plan),
+                        morph_layer_input=plan.morph_layer_input)
+
+# Return a NerTrainer with the settings that reads only the layers of the plan, runs only the
+# feature extractors the templates need (see PlannedSettings) and applies the compiled
+# feature templates
+# use_feature_cache: read the features of the documents from the feature cache, so that models
+#   that differ only by the CRFSUITE_* settings do not extract the features again
+def create_ner_trainer(settings, plan=None, use_feature_cache=True):
+    if plan is None:
+        plan = plan_pipeline(settings)
+    feature_extractor = CachedFeatureExtractor if use_feature_cache else CompiledFeatureExtractor
+    planned_settings = PlannedSettings(settings, plan)
+    trainer = NerTrainer(planned_settings, morph_layer_input=plan.morph_layer_input)
+    # The settings module is copied into the model directory
+    trainer.settings = settings
+    return use_compiled_templates(trainer, feature_extractor, planned_settings)
@@ -0,0 +1,89 @@
+import os
+import json
+import zlib
+import sqlite3
+
+from estnltk.converters import layer_to_dict, dict_to_layer
+
+# Location of the cache of preprocessed layers (shared by all notebooks)
+preprocessing_cache_location = os.path.join('..', 'data', 'preprocessing_cache.sqlite')
+
+# Layers created by the preprocessing, in the order in which they can be restored
+preprocessing_layers = ['tokens', 'compound_tokens', 'words', 'sentences', 'morph_analysis']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS preprocessed (
+    text_hash TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    layers BLOB NOT NULL,
+    PRIMARY KEY (text_hash, config_hash)
+)
+'''
+
+# A single-file (SQLite) cache of the layers created by preprocess_text, keyed by the hash
+# of the text and the hash of the preprocessing settings. The layers are stored as
+# zlib-compressed JSON. Several processes can use the same cache file.
+class PreprocessingCache:
+
+    def __init__(self, location=preprocessing_cache_location):
+        self.location = location
+        self.connection = sqlite3.connect(location, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(schema)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM preprocessed').fetchone()[0]
+
+    # Add the cached layers to the text
+    # Output: True if the text was in the cache, False otherwise
+    def restore(self, text, text_hash, config_hash):
+        row = self.connection.execute('SELECT layers FROM preprocessed WHERE text_hash = ? AND config_hash = ?',
+                                      (text_hash, config_hash)).fetchone()
+        if row is None:
+            return False
+        layer_dicts = json.loads(zlib.decompress(row[0]).decode('UTF-8'))
+        if any(layer_dict['name'] in text.layers for layer_dict in layer_dicts):
+            return False
+        for layer_dict in layer_dicts:
+            text.add_layer(dict_to_layer(layer_dict, text))
+        return True
+
+    # Save the given preprocessing layers of the text
+    def store(self, text, text_hash, config_hash, layer_names):
+        layer_dicts = [layer_to_dict(text[name]) for name in preprocessing_layers if name in layer_names]
+        layers = zlib.compress(json.dumps(layer_dicts, ensure_ascii=False).encode('UTF-8'))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO preprocessed VALUES (?, ?, ?)',
+                                    (text_hash, config_hash, layers))
+
+    # Remove the entries that were made with other preprocessing settings
+    def remove_outdated(self, config_hash):
+        with self.connection:
+            self.connection.execute('DELETE FROM preprocessed WHERE config_hash != ?', (config_hash,))
+        self.connection.execute('VACUUM')
+
+preprocessing_cache = None
+preprocessing_cache_pid = None
+
+# Return the cache at preprocessing_cache_location (opened once per process, as SQLite
+# connections cannot be shared with worker processes). Without the data directory
+# (or with preprocessing_cache_location set to None) no cache is used.
+def get_preprocessing_cache():
+    global preprocessing_cache, preprocessing_cache_pid
+    if preprocessing_cache_location is None or not os.path.isdir(os.path.dirname(preprocessing_cache_location) or '.'):
+        return None
+    if preprocessing_cache is None or preprocessing_cache_pid != os.getpid() \
+            or preprocessing_cache.location != preprocessing_cache_location:
+        preprocessing_cache = PreprocessingCache(preprocessing_cache_location)
+        preprocessing_cache_pid = os.getpid()
+    return preprocessing_cache
@@ -1,45 +1,137 @@
-import re
+import os
+import json
+import hashlib
+from importlib.metadata import version
+from multiprocessing import Pool
 
 from estnltk import Text
-from estnltk.taggers import Retagger
 from estnltk.taggers import CompoundTokenTagger
-from estnltk.taggers import TokenSplitter
-
-token_splitter = TokenSplitter(patterns=[re.compile(r'(?P<end>[A-ZÕÄÖÜ]{1}\w+)[A-ZÕÄÖÜ]{1}\w+'),\
-                                         re.compile(r'(?P<end>Piebenomme)metsawaht'),\
-                                         re.compile(r'(?P<end>maa)peal'),\
-                                         re.compile(r'(?P<end>reppi)käest'),\
-                                         re.compile(r'(?P<end>Kiidjerwelt)J'),\
-                                         re.compile(r'(?P<end>Ameljanow)Persitski'),\
-                                         re.compile(r'(?P<end>mõistmas)Mihkel'),\
-                                         re.compile(r'(?P<end>tema)Käkk'),\
-                                         re.compile(r'(?P<end>Ahjawalla)liikmed'),\
-                                         re.compile(r'(?P<end>kohtumees)A'),\
-                                         re.compile(r'(?P<end>Pechmann)x'),\
-                                         re.compile(r'(?P<end>pölli)Anni'),\
-                                         re.compile(r'(?P<end>külla)Rauba'),\
-                                         re.compile(r'(?P<end>kohtowannem)Jaak'),\
-                                         re.compile(r'(?P<end>rannast)Leno'),\
-                                         re.compile(r'(?P<end>wallast)Kiiwita'),\
-                                         re.compile(r'(?P<end>wallas)Kristjan'),\
-                                         re.compile(r'(?P<end>Pedoson)rahul'),\
-                                         re.compile(r'(?P<end>pere)Jaan'),\
-                                         re.compile(r'(?P<end>kohtu)poolest'),\
-                                         re.compile(r'(?P<end>Kurrista)kaudo'),\
-                                         re.compile(r'(?P<end>mölder)Gottlieb'),\
-                                         re.compile(r'(?P<end>wöörmündri)Jaan'),\
-                                         re.compile(r'(?P<end>Oinas)ja'),\
-                                         re.compile(r'(?P<end>ette)Leenu'),\
-                                         re.compile(r'(?P<end>Tommingas)peab'),\
-                                         re.compile(r'(?P<end>wäljaja)Kotlep'),\
-                                         re.compile(r'(?P<end>pea)A'),\
-                                         re.compile(r'(?P<end>talumees)Nikolai')])
-
-c = CompoundTokenTagger(tag_initials = False, tag_abbreviations = False, tag_hyphenations = False)
-
-def preprocess_text(text):
+from estnltk.taggers import VabamorfTagger
+from estnltk.converters import json_to_text, text_to_json
+
+from modules.manual_morph import manual_morph_layer, is_manually_analysed, manual_morph_cache_hash, text_hash
+from modules.preprocessing_cache import get_preprocessing_cache, preprocessing_layers
+from modules.token_splitting import GluedTokenSplitter, generic_pattern
+from modules.morph_memoisation import MemoisedVabamorf
+
+# Splits tokens that consist of two glued words (the rules are in data/token_splitter_rules.txt)
+token_splitter = GluedTokenSplitter()
+
+compound_token_tagger_settings = dict(tag_initials = False, tag_abbreviations = False, tag_hyphenations = False)
+
+c = CompoundTokenTagger(**compound_token_tagger_settings)
+
+# Vabamorf with the analyses of the word forms (in their context) kept in memory (see modules/morph_memoisation.py);
+# memoised_vabamorf.statistics() shows how many analyses came from the cache
+memoised_vabamorf = MemoisedVabamorf()
+morph_tagger = VabamorfTagger(vm_instance=memoised_vabamorf)
+
+# Settings of the preprocessing steps. Files preprocessed with different settings are
+# considered outdated (e.g. by the incremental BRAT to JSON conversion).
+# use_manual_morph: whether the manual analyses of the hand-analysed protocols are used
+#   (the hash of the manual analyses is included, see modules/manual_morph.py)
+def get_preprocessing_config(use_manual_morph=False):
+    return {
+        'token_splitter': [generic_pattern.pattern] + ['\t'.join(rule) for rule in token_splitter.rules],
+        'compound_token_tagger': compound_token_tagger_settings,
+        'layers': ['tokens', 'compound_tokens', 'morph_analysis'],
+        'manual_morph': manual_morph_cache_hash() if use_manual_morph else None
+    }
+
+# Installed version of EstNLTK (the estnltk package has no __version__)
+estnltk_version = version('estnltk')
+
+preprocessing_config_hashes = dict()
+
+# Return the hash of the preprocessing settings and EstNLTK's version (the key of the
+# preprocessing cache together with the hash of the text)
+def get_preprocessing_config_hash(use_manual_morph=False):
+    if use_manual_morph not in preprocessing_config_hashes:
+        config = {'preprocessing': get_preprocessing_config(use_manual_morph), 'estnltk': estnltk_version}
+        preprocessing_config_hashes[use_manual_morph] = \
+            hashlib.sha256(json.dumps(config, sort_keys=True).encode('UTF-8')).hexdigest()
+    return preprocessing_config_hashes[use_manual_morph]
+
+# Add the tokens (with the glued words split), compound tokens, words and sentences
+def tokenise(text):
     text.tag_layer(['tokens'])
     token_splitter.retag(text)
     c.tag(text)
-    text.tag_layer(['morph_analysis'])
-    return text
\ No newline at end of file
+    text.tag_layer(['words', 'sentences'])
+    return text
+
+# Tokenise the text and add the morphological analysis. With use_manual_morph, the manual
+# analyses are used instead of Vabamorf for the hand-analysed protocols (see
+# modules/manual_morph.py). It is off by default: the training and test texts have to be
+# preprocessed with the same setting.
+# The layers created with Vabamorf are saved in the preprocessing cache (see
+# modules/preprocessing_cache.py) and restored from it the next time the same text is
+# preprocessed, unless use_cache is False.
+# layers: the layers that are needed (e.g. the layers of a model's PipelinePlan, see
+# modules/pipeline_planner.py); without 'morph_analysis' only the tokenisation layers and
+# sentences are created and Vabamorf is not run. By default all layers are created.
+def preprocess_text(text, use_manual_morph=False, use_cache=True, layers=None):
+    if layers is not None and 'morph_analysis' not in layers:
+        return tokenise(text)
+
+    manual = use_manual_morph and is_manually_analysed(text)
+    cache = get_preprocessing_cache() if use_cache and not manual else None
+    if cache is not None:
+        key = (text_hash(text.text), get_preprocessing_config_hash(use_manual_morph))
+        if cache.restore(text, *key):
+            return text
+    existing_layers = set(text.layers)
+
+    tokenise(text)
+    if manual:
+        morph_layer = manual_morph_layer(text)
+        if morph_layer is not None:
+            text.add_layer(morph_layer)
+            return text
+    morph_tagger.tag(text)
+
+    if cache is not None:
+        cache.store(text, *key, [layer for layer in preprocessing_layers
+                                 if layer in text.layers and layer not in existing_layers])
+    return text
+
+# Read a document to be preprocessed: a .json file (e.g. from vallakohtufailid-json-flattened)
+# or the .txt file of a protocol
+def read_document(path):
+    with open(path, 'r', encoding='UTF-8') as in_f:
+        contents = in_f.read()
+    if path.endswith('.json'):
+        return json_to_text(contents)
+    if os.path.basename(path) == "Tartu_V6nnu_Ahja_id3502_1882a.txt":
+        contents = contents.replace('..', '. .')
+    return Text(contents)
+
+# Load the taggers of a worker process once, before it gets any documents
+def init_preprocessing_worker():
+    preprocess_text(Text('Tere.'), use_manual_morph=False, use_cache=False)
+
+# Preprocess a document in a worker process
+# Input: a job tuple (path, use_manual_morph, use_cache, layers)
+# Output: the preprocessed Text object as .json contents
+def preprocess_document(job):
+    path, use_manual_morph, use_cache, layers = job
+    return text_to_json(preprocess_text(read_document(path), use_manual_morph, use_cache, layers))
+
+# Preprocess the documents (.json or .txt files, see read_document) in a pool of worker
+# processes. Each worker loads the taggers once and gets the documents in chunks of
+# chunk_size. With workers=1 the documents are preprocessed in this process.
+# Output: a generator of the preprocessed Text objects in the order of the paths
+def preprocess_corpus(paths, workers=None, chunk_size=4, use_manual_morph=False, use_cache=True, layers=None):
+    jobs = ((path, use_manual_morph, use_cache, layers) for path in paths)
+    if workers == 1:
+        for path, use_manual_morph, use_cache, layers in jobs:
+            yield preprocess_text(read_document(path), use_manual_morph, use_cache, layers)
+        return
+
+    pool = Pool(processes=workers, initializer=init_preprocessing_worker)
+    try:
+        for document in pool.imap(preprocess_document, jobs, chunksize=chunk_size):
+            yield json_to_text(document)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -5,15 +5,51 @@ import json
 from estnltk.converters import json_to_text
 from nervaluate import Evaluator
 
-def extract_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, file):
+from modules.span_reader import read_ner_spans
+from modules.document_store import DocumentStore
+
+# Named entities read from the .json files, reused until the files are modified
+span_cache = dict()
+
+# Read the named entities of a layer of a file. The location is either a directory of
+# .json files or a DocumentStore.
+def read_spans(location, file, layer_name, cache):
+    if isinstance(location, DocumentStore):
+        return location.ner_spans(file, layer_name)
+    return read_ner_spans(os.path.join(location, file), layer_name, cache)
+
+# Read the named entities of a layer of several files: a DocumentStore is read in a single
+# query, a directory file by file
+# Output: a dictionary {file: named entities}
+def read_all_spans(location, files, layer_name, cache):
+    if isinstance(location, DocumentStore):
+        return dict(location.iter_ner_spans(layer_name, files))
+    return {file: read_ner_spans(os.path.join(location, file), layer_name, cache) for file in files}
+
+# Read the .json contents of a file from a directory or a DocumentStore
+def read_json(location, file):
+    if isinstance(location, DocumentStore):
+        return location.get(file)
+    with open(os.path.join(location, file), 'r', encoding='UTF-8') as in_f:
+        return in_f.read()
+
+# Get the goldstandard ('gold_ner') and tagged ('flat_ner') named entities of a file.
+# The locations of the files can be directories or DocumentStores.
+# By default the spans are read straight from the .json files. With use_json_to_text=True
+# the files are converted into Text objects first (slower, but uses EstNLTK's parsing).
+def extract_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, file,
+                        use_json_to_text=False, cache=span_cache):
     gold = list()
     test = list()
     
     if file.endswith('.json') and file not in no_goldstandard_annotations:
-        with open(os.path.join(trained_files_location, file), 'r', encoding='UTF-8') as f_test:
-            test_import = json_to_text(f_test.read())
-        with open(os.path.join(testing_files_location, file), 'r', encoding='UTF-8') as f_gold:
-            gold_import = json_to_text(f_gold.read())
+        if not use_json_to_text:
+            gold = read_spans(testing_files_location, file, 'gold_ner', cache)
+            test = read_spans(trained_files_location, file, 'flat_ner', cache)
+            return gold, test
+
+        test_import = json_to_text(read_json(trained_files_location, file))
+        gold_import = json_to_text(read_json(testing_files_location, file))
 
         for i in range(len(gold_import['gold_ner'])):
             ner = gold_import['gold_ner'][i]
@@ -31,14 +67,27 @@ def extract_annotations(no_goldstandard_annotations, trained_files_location, tes
     
     return gold, test
 
+# Get the goldstandard and tagged named entities of several files (see extract_annotations).
+# The spans of each location are read in one pass.
+# Output: a dictionary {file: (gold, test)}
+def extract_all_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, files,
+                            cache=span_cache):
+    evaluated = [file for file in files if file.endswith('.json') and file not in no_goldstandard_annotations]
+    gold = read_all_spans(testing_files_location, evaluated, 'gold_ner', cache)
+    test = read_all_spans(trained_files_location, evaluated, 'flat_ner', cache)
+    return {file: (gold.get(file, []), test.get(file, [])) for file in files}
+
 def extract_results(files, no_goldstandard_annotations, trained_files_location, testing_files_location, results_location):
     
+    annotations = extract_all_annotations(no_goldstandard_annotations, trained_files_location,
+                                          testing_files_location, list(files))
+    
     if (len(set(files.values())) == 1):
         gold_ner = list()
         test_ner = list()
         
         for file in [key for key, value in files.items()]:
-            gold, test = extract_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, file)
+            gold, test = annotations[file]
             gold_ner.append(gold)
             test_ner.append(test)
         
@@ -54,7 +103,7 @@ def extract_results(files, no_goldstandard_annotations, trained_files_location,
             test_ner = list()
             
             for file in [key for key, value in files.items() if int(value) == int(subdistribution)]:
-                gold, test = extract_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, file)
+                gold, test = annotations[file]
                 gold_ner.append(gold)
                 test_ner.append(test)
     
@@ -193,8 +242,10 @@ def confusion_matrix(model_dir, files, no_goldstandard_annotations, trained_file
     gold_ner = []
     test_ner = []
 
+    annotations = extract_all_annotations(no_goldstandard_annotations, trained_files_location,
+                                          testing_files_location, list(files))
     for file in files:
-        gold, test = extract_annotations(no_goldstandard_annotations, trained_files_location, testing_files_location, file)
+        gold, test = annotations[file]
         
         gold_ner.append(gold)
         test_ner.append(test)
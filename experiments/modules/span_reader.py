@@ -0,0 +1,35 @@
+import os
+import json
+
+# Read the spans of a layer from the data of an EstNLTK .json file without creating a
+# Text object. For ambiguous layers the first annotation of a span is used.
+# Output: a list of tuples (start, end, annotation value)
+def read_layer_spans(data, layer_name, attribute='nertag'):
+    for layer in data['layers']:
+        if layer['name'] == layer_name:
+            return [(span['base_span'][0], span['base_span'][1], span['annotations'][0][attribute])
+                    for span in layer['spans']]
+    return []
+
+# Read the named entities of a layer (e.g. 'gold_ner' or 'flat_ner') from an EstNLTK .json file
+# Output: a list of dictionaries {"label": ..., "start": ..., "end": ...}, as expected by nervaluate
+# If a cache (a dictionary) is given, the spans are stored in it and reused for as long as
+# the file has not been modified.
+def read_ner_spans(path, layer_name, cache=None):
+    if cache is not None:
+        key = (os.path.abspath(path), layer_name)
+        status = os.stat(path)
+        modified = (status.st_mtime_ns, status.st_size)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == modified:
+            return [dict(span) for span in cached[1]]
+
+    with open(path, 'r', encoding='UTF-8') as in_f:
+        data = json.load(in_f)
+    spans = [{"label": label, "start": int(start), "end": int(end)}
+             for start, end, label in read_layer_spans(data, layer_name)]
+
+    if cache is not None:
+        cache[key] = (modified, spans)
+        return [dict(span) for span in spans]
+    return spans
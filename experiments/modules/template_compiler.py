@@ -0,0 +1,191 @@
+from collections import namedtuple
+
+import numpy as np
+from estnltk.taggers import NerTagger, Retagger, Tagger
+from estnltk.taggers.estner import CrfsuiteModel
+from estnltk.taggers.estner.model_storage_util import ModelStorageUtil
+from estnltk.taggers.estner.fex import FeatureExtractor
+
+from models.protocols_fex import ner_feature_attributes
+
+# A feature template compiled for applying it to a whole sentence at once
+# name: the name of the CRF attribute, e.g. 'lem[0]|lem[-1]'
+# fields, offsets: the feature attributes and their offsets
+# before, after: the number of tokens that the template looks back and ahead (the template
+#   applies to the tokens before..n - after of a sentence of n tokens)
+CompiledTemplate = namedtuple('CompiledTemplate', ['name', 'fields', 'offsets', 'before', 'after'])
+
+# Check the feature templates (settings.TEMPLATES) and compile them
+# attributes: the known feature attributes (not checked if None)
+# deduplicate: leave out the repeated templates (apply_templates adds their attributes twice)
+# Output: a list of CompiledTemplate
+def compile_templates(templates, attributes=None, deduplicate=True):
+    compiled = []
+    seen = set()
+    for template in templates:
+        template = tuple(tuple(item) if isinstance(item, list) else item for item in template)
+        if not template or not all(isinstance(item, tuple) and len(item) == 2 and isinstance(item[0], str)
+                                   and isinstance(item[1], int) for item in template):
+            raise ValueError('a feature template must be a non-empty tuple of (attribute, offset) pairs, got {!r}'
+                             .format(template))
+        unknown = [field for field, offset in template if attributes is not None and field not in attributes]
+        if unknown:
+            raise ValueError('unknown feature attributes {} in the template {!r}'.format(unknown, template))
+        if deduplicate and template in seen:
+            continue
+        seen.add(template)
+
+        name = '|'.join('%s[%d]' % (field, offset) for field, offset in template)
+        if name == 'ending[0]':
+            name = 'end[0]'
+        offsets = tuple(offset for field, offset in template)
+        compiled.append(CompiledTemplate(name, tuple(field for field, offset in template), offsets,
+                                         max(0, -min(offsets)), max(0, max(offsets))))
+    return compiled
+
+# Return the attribute value of a template for one token as apply_templates joins it: a set
+# (of gazetteer labels) is joined with the values of the second field, otherwise only the
+# first two fields of a two-field template are joined
+def join_values(values):
+    first = values[0]
+    if isinstance(first, set):
+        joinable = list(first)
+        if len(values) > 1:
+            joinable.extend(values[1])
+        return '|'.join(joinable)
+    if len(values) == 2:
+        return first + '|' + values[1]
+    return first
+
+# The values of a feature attribute for the tokens of a text as numpy arrays
+# values: the values (objects)
+# present: whether each value is not None
+# labels: True if the values are sets (of gazetteer labels)
+FieldColumn = namedtuple('FieldColumn', ['values', 'present', 'labels'])
+
+# Return the FieldColumn of the values of a feature attribute
+def field_column(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return FieldColumn(array, array != None, any(isinstance(value, set) for value in values))
+
+# Apply the compiled templates to the sentences of a text given as columns of feature values:
+# the values of each field of a template are gathered for all tokens of the text at once (the
+# token at position p of a sentence gets the values of the tokens p + offset of the same
+# sentence), and the attributes of a token are the values of the templates in their order.
+# columns: a dictionary {feature attribute: list of the values of the tokens}
+# sentence_lengths: the numbers of tokens of the sentences
+# Output: a list of the CRF attributes of each token (the same as apply_templates creates)
+def text_attributes(columns, sentence_lengths, templates):
+    sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+    n = int(sentence_lengths.sum())
+    # The position of each token in its sentence and the length of its sentence
+    lengths = np.repeat(sentence_lengths, sentence_lengths)
+    positions = np.arange(n) - np.repeat(np.cumsum(sentence_lengths) - sentence_lengths, sentence_lengths)
+
+    field_columns = dict()
+    # The attribute of template k for token i is attributes[i, k] if present[i, k]
+    attributes = np.empty((n, len(templates)), dtype=object)
+    present = np.zeros((n, len(templates)), dtype=bool)
+    for k, template in enumerate(templates):
+        if any(field not in columns for field in template.fields):
+            continue
+        for field in template.fields:
+            if field not in field_columns:
+                field_columns[field] = field_column(columns[field])
+        tokens = np.nonzero((positions >= template.before) & (positions < lengths - template.after))[0]
+        # The values of the first two fields have to be present, as in apply_templates
+        gathered = [(field_columns[field], tokens + offset) for field, offset in zip(template.fields, template.offsets)]
+        keep = gathered[0][0].present[gathered[0][1]]
+        if len(gathered) > 1:
+            keep &= gathered[1][0].present[gathered[1][1]]
+        values = [column.values[indices[keep]] for column, indices in gathered]
+        tokens = tokens[keep]
+
+        prefix = template.name + '='
+        if gathered[0][0].labels:
+            # The gazetteer labels are joined one token at a time (see join_values)
+            joined = [prefix + join_values(token_values) for token_values in zip(*values)]
+        elif len(values) == 2:
+            joined = prefix + values[0] + '|' + values[1]
+        else:
+            joined = prefix + values[0]
+        attributes[tokens, k] = joined
+        present[tokens, k] = True
+
+    # The attributes of the tokens one after another, and the end of the attributes of each token
+    flat = attributes[present].tolist()
+    ends = np.cumsum(present.sum(axis=1)).tolist()
+    return [flat[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+# Apply the compiled templates to a sentence given as columns of feature values (see text_attributes)
+def sentence_attributes(columns, n, templates):
+    return text_attributes(columns, [n], templates)
+
+# A faster version of estnltk's apply_templates: the feature values of the text are read into
+# columns once, and each template is applied to all tokens at once by gathering the values
+# at its offsets (see text_attributes), instead of reading the values of every template and
+# token from the spans
+def apply_compiled_templates(text, templates, layers=('morph_analysis', 'words', 'sentences')):
+    features_layer = text['ner_features']
+    used = {field for template in templates for field in template.fields}
+    field_names = [attribute for attribute in features_layer.attributes if attribute in used]
+    sentence_lengths = [len(sentence) for sentence in text[layers[2]]]
+    spans = list(features_layer)[:sum(sentence_lengths)]
+    annotations = [span.annotations[0] for span in spans]
+    columns = {field: [annotation[field] for annotation in annotations] for field in field_names}
+    for span, attributes in zip(spans, text_attributes(columns, sentence_lengths, templates)):
+        for annotation in span.annotations:
+            annotation['F'] = attributes
+
+# Run a feature extractor on a document: a Retagger adds its features to the 'ner_features'
+# layer, a Tagger creates the layer, and the other extractors have a process method
+def run_feature_extractor(fex, doc):
+    if isinstance(fex, Retagger):
+        fex.retag(doc)
+    elif isinstance(fex, Tagger):
+        fex.tag(doc)
+    else:
+        fex.process(doc)
+
+class CompiledFeatureExtractor(FeatureExtractor):
+    """FeatureExtractor that applies the compiled feature templates (see compile_templates).
+    The repeated templates are left out if DEDUPLICATE_TEMPLATES = True in settings.py; the
+    settings are saved with the model, so the model is tagged with the same templates.
+    """
+
+    def __init__(self, settings, morph_layer_inputs):
+        super().__init__(settings, morph_layer_inputs)
+        self.templates = compile_templates(settings.TEMPLATES, attributes=ner_feature_attributes,
+                                           deduplicate=getattr(settings, 'DEDUPLICATE_TEMPLATES', False))
+
+    def process(self, docs):
+        for fex in self.fex_list:
+            for doc in docs:
+                run_feature_extractor(fex, doc)
+        for doc in docs:
+            apply_compiled_templates(doc, self.templates, self.morph_layer_inputs)
+
+
+class CompiledTemplatesNerTagger(NerTagger):
+    """NerTagger that extracts the features with CompiledFeatureExtractor (or its subclass
+    given as feature_extractor). The settings of the feature extractors can be given as
+    nersettings (e.g. pipeline_planner.PlannedSettings); by default they are loaded from the
+    model directory. NerTagger's own FeatureExtractor is not created.
+    """
+
+    def __init__(self, model_dir, feature_extractor=CompiledFeatureExtractor, nersettings=None, output_layer='ner',
+                 morph_layer_input='morph_analysis', words_layer_input='words', sentences_layer_input='sentences'):
+        self.output_layer = output_layer
+        self.output_attributes = ["nertag"]
+        self.modelUtil = ModelStorageUtil(model_dir)
+        self.nersettings = nersettings if nersettings is not None else self.modelUtil.load_settings()
+        self.input_layers = (morph_layer_input, words_layer_input, sentences_layer_input)
+        self.fex = feature_extractor(self.nersettings, self.input_layers)
+        self.crf_model = CrfsuiteModel(settings=self.nersettings, model_filename=self.modelUtil.model_filename)
+
+# Make a NerTrainer extract the features with CompiledFeatureExtractor (or its subclass)
+# settings: the settings of the feature extractors (by default the trainer's settings)
+def use_compiled_templates(trainer, feature_extractor=CompiledFeatureExtractor, settings=None):
+    trainer.fex = feature_extractor(settings if settings is not None else trainer.settings, trainer.input_layers)
+    return trainer
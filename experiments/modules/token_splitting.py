@@ -0,0 +1,99 @@
+import os
+import re
+from typing import MutableMapping
+
+from estnltk import Text
+from estnltk.layer.layer import Layer
+from estnltk.taggers import Retagger
+
+# Location of the glued word rules (two parts of a glued word separated by a tab on each line)
+token_splitter_rules_location = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'token_splitter_rules.txt')
+
+# Two capitalised words glued together (e.g. JaanPark); the token is split after the first word
+generic_pattern = re.compile(r'(?P<end>[A-ZÕÄÖÜ]{1}\w+)[A-ZÕÄÖÜ]{1}\w+')
+
+# Read the glued word rules
+# Output: a list of tuples (first part, second part) in the order of the file
+def read_token_splitter_rules(rules_location=token_splitter_rules_location):
+    rules = []
+    with open(rules_location, 'r', encoding='UTF-8') as in_f:
+        for line in in_f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            first, second = line.split('\t')
+            rules.append((first, second))
+    return rules
+
+class GluedTokenSplitter(Retagger):
+    """Splits tokens that consist of two glued words. Works like EstNLTK's TokenSplitter
+    with the generic capitalised words pattern followed by one pattern per glued word rule,
+    but the rules are compiled into a single matcher: one regular expression alternation
+    rejects the tokens that contain no glued word, and a character trie finds the rules
+    that match. The cost of splitting a token does not grow with the number of rules.
+    As in TokenSplitter, a token is split only once: if several rules match, the generic
+    pattern is applied first and then the rule that comes first in the rules file.
+    """
+    conf_param = ['rules', 'literal_pattern', 'trie']
+
+    def __init__(self, rules=None, output_layer='tokens'):
+        self.output_layer = output_layer
+        self.input_layers = [output_layer]
+        self.output_attributes = ()
+        self.rules = read_token_splitter_rules() if rules is None else rules
+
+        # Longer words first, so that the alternation does not stop at a shorter rule
+        words = sorted({first + second for first, second in self.rules}, key=len, reverse=True)
+        self.literal_pattern = re.compile('|'.join(re.escape(word) for word in words)) if words else None
+
+        # Each trie node is a dictionary of child nodes; None marks the indexes of the rules ending there
+        self.trie = dict()
+        for index, (first, second) in enumerate(self.rules):
+            node = self.trie
+            for character in first + second:
+                node = node.setdefault(character, dict())
+            node.setdefault(None, []).append(index)
+
+    # Return the position in the token after which it should be split (or None)
+    def split_point(self, token_str):
+        m = generic_pattern.search(token_str)
+        if m:
+            return m.end('end')
+
+        if self.literal_pattern is None:
+            return None
+        m = self.literal_pattern.search(token_str)
+        if m is None:
+            return None
+
+        # The first rule (in the order of the rules) that matches, at its leftmost position
+        best_rule = None
+        best_point = None
+        for start in range(m.start(), len(token_str)):
+            node = self.trie
+            for character in token_str[start:]:
+                node = node.get(character)
+                if node is None:
+                    break
+                for index in node.get(None, ()):
+                    point = start + len(self.rules[index][0])
+                    if (best_rule is None or index < best_rule) and 0 < point < len(token_str):
+                        best_rule = index
+                        best_point = point
+        return best_point
+
+    def _change_layer(self, text: Text, layers: MutableMapping[str, Layer], status: dict):
+        changeble_layer = layers[self.output_layer]
+        add_spans = []
+        remove_spans = []
+        for span in changeble_layer:
+            token_str = text.text[span.start:span.end]
+            point = self.split_point(token_str)
+            if point is not None:
+                add_spans.append((span.start, span.start + point))
+                add_spans.append((span.start + point, span.end))
+                remove_spans.append(span)
+        for old_span in remove_spans:
+            changeble_layer.remove_span(old_span)
+        for new_span in add_spans:
+            changeble_layer.add_annotation(new_span)
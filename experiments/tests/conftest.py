@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the modules as the notebooks do (from modules.* and models.*), relative to
+# the experiments directory
+experiments_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if experiments_dir not in sys.path:
+    sys.path.insert(0, experiments_dir)
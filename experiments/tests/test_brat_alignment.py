@@ -0,0 +1,39 @@
+from modules.brat_alignment import BratAlignmentIndex
+
+# 'Jaan Tamm\nkaebas  Gustav Waddi peale.' with its words
+text = 'Jaan Tamm\nkaebas  Gustav Waddi peale.'
+word_spans = [(0, 4), (5, 9), (10, 16), (18, 24), (25, 30), (31, 36), (36, 37)]
+
+
+def test_brat_offsets_count_linebreaks_twice():
+    index = BratAlignmentIndex(text, word_spans)
+    assert index.to_text_offset(0) == 0
+    assert index.to_text_offset(9) == 9
+    # 'kaebas' starts at 10 in the text and at 11 in BRAT
+    assert index.to_text_offset(11) == 10
+    assert index.to_text_offset(20) == 19
+
+
+def test_align_words_before_and_after_linebreak():
+    index = BratAlignmentIndex(text, word_spans)
+    assert index.align(0, 4) == (0, 1)
+    assert index.align(0, 9) == (0, 2)
+    assert index.align(19, 31) == (3, 5)
+
+
+def test_align_ignores_trailing_whitespace():
+    index = BratAlignmentIndex(text, word_spans)
+    assert index.align(0, 5) == (0, 1)
+    assert index.align(11, 19) == (2, 3)
+
+
+def test_align_outside_word_boundary():
+    index = BratAlignmentIndex(text, word_spans)
+    assert index.align(1, 4) is None
+    assert index.align(5, 5) is None
+
+
+def test_align_fragments_uses_first_start_and_last_end():
+    index = BratAlignmentIndex(text, word_spans)
+    assert index.align_fragments('5 9;11 17') == (1, 3)
+    assert index.align_fragments('0 4') == (0, 1)
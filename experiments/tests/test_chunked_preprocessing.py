@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip('estnltk')
+
+from estnltk import Text
+from estnltk.converters import json_to_text, text_to_dict
+
+from modules.chunked_preprocessing import find_chunks, preprocess_text_chunked, write_preprocessed_chunked
+from modules.preprocessing_protocols import preprocess_text
+
+cases = ('1) Jaan Tamm kaebas, et Mart Kask on temale 5 rubla wõlgu.\n'
+         '2) Mart Kask ütles, et tema on selle raha\n'
+         '1873. aastal ära maksnud ja et Jaan Tamm seda\n'
+         '2. Mail ise kohtu ees tunnistanud.\n'
+         '3) Kohus mõistis, et Mart Kask peab 5 rubla maksma.\n\n'
+         'Kohtumees Hans Saar')
+
+
+def boundaries(text_str):
+    return [start for start, end in find_chunks(text_str, max_chunk_size=1)]
+
+
+def test_cases_are_split_at_case_numbers_and_paragraph_endings():
+    starts = boundaries(cases)
+    assert [cases[start:start + 2] for start in starts] == ['1)', '2)', '3)', 'Ko']
+
+
+def test_years_and_dates_inside_a_sentence_are_not_boundaries():
+    starts = boundaries(cases)
+    assert cases.index('1873.') not in starts
+    assert cases.index('2. Mail') not in starts
+
+
+def test_chunked_preprocessing_matches_preprocessing_at_once(tmp_path):
+    whole = text_to_dict(preprocess_text(Text(cases), use_cache=False))
+    assert text_to_dict(preprocess_text_chunked(Text(cases), max_chunk_size=60, use_cache=False)) == whole
+
+    path = str(tmp_path / 'protocol.json')
+    write_preprocessed_chunked(Text(cases), path, max_chunk_size=60, use_cache=False)
+    with open(path, 'r', encoding='UTF-8') as in_f:
+        assert text_to_dict(json_to_text(in_f.read())) == whole
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+pytest.importorskip('estnltk')
+
+from modules.document_store import DocumentStore
+
+
+def document(label):
+    return json.dumps({'text': 'Jaan Tamm', 'meta': {}, 'layers': [
+        {'name': 'gold_ner', 'attributes': ['nertag'], 'spans': [
+            {'base_span': [0, 9], 'annotations': [{'nertag': label}]}]}]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    with DocumentStore(str(tmp_path / 'documents.sqlite')) as store:
+        for filename, label in [('a.json', 'PER'), ('b.json', 'LOC'), ('c.json', 'ORG')]:
+            store.put(filename, document(label))
+        yield store
+
+
+def test_iter_documents_keeps_the_callers_order(store):
+    assert [filename for filename, _ in store.iter_documents()] == ['a.json', 'b.json', 'c.json']
+    assert [filename for filename, _ in store.iter_documents(['c.json', 'a.json'])] == ['c.json', 'a.json']
+
+
+def test_iter_documents_raises_on_missing_file(store):
+    with pytest.raises(KeyError):
+        list(store.iter_documents(['a.json', 'missing.json']))
+
+
+def test_iter_ner_spans(store):
+    spans = dict(store.iter_ner_spans('gold_ner', ['b.json', 'a.json']))
+    assert spans == {'b.json': [{'label': 'LOC', 'start': 0, 'end': 9}],
+                     'a.json': [{'label': 'PER', 'start': 0, 'end': 9}]}
+    assert spans['a.json'] == store.ner_spans('a.json', 'gold_ner')
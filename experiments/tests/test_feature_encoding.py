@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip('estnltk')
+pytest.importorskip('pycrfsuite')
+
+from modules.feature_encoding import FeatureDictionary, encode_sentence, sentence_items
+
+
+def test_ids_are_given_in_the_order_of_appearance():
+    dictionary = FeatureDictionary()
+    assert [dictionary.encode(feature) for feature in ['w=Jaan', 'iu', 'w=Jaan']] == [0, 1, 0]
+    assert dictionary.encode('w=Tamm', grow=False) is None
+    assert len(dictionary) == 2
+
+
+def test_saved_dictionary_loads_with_the_same_ids(tmp_path):
+    dictionary = FeatureDictionary()
+    for feature in ['w=Jaan', 'lem[0]|lem[-1]=jaan|kohus', 'w=Tõnis']:
+        dictionary.encode(feature)
+    path = str(tmp_path / 'feature_dictionary.txt')
+    dictionary.save(path)
+
+    loaded = FeatureDictionary.load(path)
+    assert loaded.buckets is None
+    assert loaded.features == dictionary.features
+    assert loaded.encode('w=Tõnis', grow=False) == 2
+
+
+def test_hashed_dictionary_saves_only_the_number_of_buckets(tmp_path):
+    dictionary = FeatureDictionary(buckets=1000)
+    feature_id = dictionary.encode('w=Jaan')
+    assert 0 <= feature_id < 1000
+    path = str(tmp_path / 'feature_dictionary.txt')
+    dictionary.save(path)
+
+    loaded = FeatureDictionary.load(path)
+    assert len(loaded) == 1000
+    assert loaded.encode('w=Jaan', grow=False) == feature_id
+
+
+def test_encoded_sentence_leaves_out_unknown_features():
+    dictionary = FeatureDictionary()
+    encode_sentence([['w=Jaan', 'iu'], ['w=Tamm']], dictionary)
+    sentence = encode_sentence([['w=Jaan', 'w=Kask'], ['iu', 'w=Tamm']], dictionary, grow=False)
+    assert list(sentence.offsets) == [0, 1, 3]
+    assert sentence_items(sentence) == [['0'], ['1', '2']]
@@ -0,0 +1,55 @@
+import os
+
+from models.gazetteer_index import GazetteerIndex, compile_gazetteer, get_gazetteer_index, load_gazetteer_index
+
+gazetteer = {
+    'tartu': {'LOC'},
+    'tartu vallakohus': {'ORG'},
+    'jaan': {'PER'},
+    'jaan tamm': {'PER'},
+    'kohila': {'LOC', 'ORG'},
+}
+
+
+def index():
+    return GazetteerIndex(compile_gazetteer(gazetteer))
+
+
+def test_lookup_like_a_dictionary():
+    gazetteer_index = index()
+    assert len(gazetteer_index) == len(gazetteer)
+    assert gazetteer_index['kohila'] == {'LOC', 'ORG'}
+    assert gazetteer_index.get('tartu vallakohus') == {'ORG'}
+    # A prefix of a phrase is not a phrase
+    assert 'tartu valla' not in gazetteer_index
+    assert 'vallakohus' not in gazetteer_index
+    assert gazetteer_index.get('tamm') is None
+
+
+def test_matches_finds_the_overlapping_phrases_in_order():
+    keys = ['jaan', 'tamm', 'ja', 'tartu', 'vallakohus']
+    assert list(index().matches(keys)) == [
+        (0, 1, {'PER'}), (0, 2, {'PER'}), (3, 4, {'LOC'}), (3, 5, {'ORG'})]
+
+
+def test_matches_starts_and_look_ahead():
+    keys = ['jaan', 'tamm', 'ja', 'tartu', 'vallakohus']
+    starts = [False, False, False, True, True]
+    assert list(index().matches(keys, starts)) == [(3, 4, {'LOC'}), (3, 5, {'ORG'})]
+    assert list(index().matches(keys, look_ahead=1)) == [(0, 1, {'PER'}), (3, 4, {'LOC'})]
+
+
+def test_matches_a_token_with_a_space():
+    assert list(index().matches(['jaan tamm', 'x'])) == [(0, 1, {'PER'})]
+
+
+def test_index_file_is_shared_and_compiled_again_when_the_gazetteer_changes(tmp_path):
+    gazetteer_file = str(tmp_path / 'gazetteer.txt')
+    with open(gazetteer_file, 'w', encoding='utf8') as f:
+        f.write('tartu\tLOC\n')
+    assert get_gazetteer_index(gazetteer_file) is get_gazetteer_index(gazetteer_file)
+    assert os.path.exists(gazetteer_file + '.index')
+
+    with open(gazetteer_file, 'w', encoding='utf8') as f:
+        f.write('tartu\tLOC\njaan tamm\tPER\n')
+    assert load_gazetteer_index(gazetteer_file)['jaan tamm'] == {'PER'}
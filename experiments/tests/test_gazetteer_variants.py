@@ -0,0 +1,18 @@
+from models.gazetteer_variants import canonical_gazetteer, canonical_key, variant_groups
+
+
+def test_spelling_variants_have_the_same_canonical_key():
+    assert canonical_key('Jögewa') == canonical_key('Jõgeva') == 'jõgeva'
+    assert canonical_key('Tomas') == canonical_key('Toomas') == 'tomas'
+    assert canonical_key('Wanemuise') == canonical_key('Vanemuise')
+
+
+def test_different_names_keep_different_keys():
+    assert canonical_key('Tamm') != canonical_key('Tamme')
+    assert canonical_key('Mart Kask') == 'mart kask'
+
+
+def test_canonical_gazetteer_joins_the_labels_of_the_variants():
+    data = {'toomas': {'PER'}, 'tomas': {'PER'}, 'wõru': {'LOC'}, 'võru': {'ORG'}}
+    assert canonical_gazetteer(data) == {'tomas': {'PER'}, 'võru': {'LOC', 'ORG'}}
+    assert variant_groups(data) == {'tomas': {'toomas', 'tomas'}, 'võru': {'wõru', 'võru'}}
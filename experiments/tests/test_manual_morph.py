@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('estnltk')
+
+from estnltk import Text
+
+import modules.manual_morph as manual_morph
+from modules.preprocessing_protocols import tokenise
+
+tsv = '\n'.join([
+    'Kohto\t####\t####\t\t\t\t',
+    '     \t#kohtu\tkohus\t0\t\tS\tsg g',
+    'mees\tmees\tmees\t0\t\tS\tsg n',
+    'H. Saarmo\t####\t####\t\t\t\t',
+    '         \t#H._Saarmo\tH._Saarmo\t0\t\tH\tsg n',
+    '""""\t""""\t""""\t\t\tZ\t',
+    '1873.\t1873.\t1873.\t0\t\tO\t?',
+    '     \t£1873\t1873\t0\t\tN\t?',
+    '<U+2116>\t<U+2116>\t<U+2116>\t0\t\tY\t?',
+])
+
+
+@pytest.fixture
+def tokens(tmp_path):
+    path = tmp_path / 'protocol.tsv'
+    path.write_text(tsv, encoding='UTF-8')
+    return manual_morph.read_manual_analyses(str(path))
+
+
+def test_unescape_field():
+    assert manual_morph.unescape_field('""""') == '"'
+    assert manual_morph.unescape_field('"K') == '"K'
+    assert manual_morph.unescape_field('<U+2116>') == '№'
+
+
+def test_read_manual_analyses(tokens):
+    assert [token[0] for token in tokens] == ['Kohto', 'mees', 'H. Saarmo', '"', '1873.', '№']
+    assert tokens[0][1:3] == ['kohtu', 'kohus']
+    assert tokens[3][1:3] == ['"', '"']
+    # The analysis marked with '£' is chosen
+    assert tokens[4][1:3] == ['1873', '1873']
+
+
+def test_manual_morph_layer_aligns_tokens_by_offsets(tokens, monkeypatch):
+    text = Text('Kohto mees H.\xa0Saarmo " 1873. №')
+    tokenise(text)
+    monkeypatch.setattr(manual_morph, 'manual_morph_cache',
+                        {manual_morph.manual_morph_key(text): {'file': 'protocol.txt', 'tokens': tokens}})
+    monkeypatch.setattr(manual_morph, 'manual_morph_statistics', manual_morph.Counter())
+
+    layer = manual_morph.manual_morph_layer(text)
+    assert layer is not None
+    assert len(layer) == len(text.words)
+    roots = {span.text: span.annotations[0]['root'] for span in layer}
+    assert roots['Kohto'] == 'kohus'
+    # A token that covers several words gives its analysis to each of them
+    assert roots['Saarmo'] == 'H._Saarmo'
+    assert roots['"'] == '"'
+    assert manual_morph.manual_morph_statistics['used'] == 1
+
+
+def test_manual_morph_layer_counts_fallbacks(tokens, monkeypatch):
+    text = Text('Kohto mees Jaan')
+    tokenise(text)
+    monkeypatch.setattr(manual_morph, 'manual_morph_cache',
+                        {manual_morph.manual_morph_key(text): {'file': 'protocol.txt', 'tokens': tokens}})
+    monkeypatch.setattr(manual_morph, 'manual_morph_statistics', manual_morph.Counter())
+
+    assert manual_morph.manual_morph_layer(text) is None
+    assert manual_morph.manual_morph_statistics['unaligned'] == 1
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('estnltk')
+
+from modules.pipeline_planner import PlannedSettings, plan_pipeline
+
+
+def settings(templates):
+    return SimpleNamespace(
+        FEATURE_EXTRACTORS=('models.protocols_fex.NerLocalFeatureWithoutMorphTagger',
+                            'models.protocols_fex.NerGazetteerFeatureTagger'),
+        TEMPLATES=templates,
+        GAZETTEER_FILE='gazetteer.txt')
+
+
+def test_gazetteer_extractor_is_skipped_when_the_templates_do_not_use_it():
+    model_settings = settings([(('iu', 0),), (('fsnt', 0),)])
+    plan = plan_pipeline(model_settings)
+    assert not plan.gazetteer
+    planned = PlannedSettings(model_settings, plan)
+    assert planned.FEATURE_EXTRACTORS == ('models.protocols_fex.NerLocalFeatureWithoutMorphTagger',)
+    assert planned.TEMPLATES is model_settings.TEMPLATES
+    assert planned.GAZETTEER_FILE == 'gazetteer.txt'
+
+
+def test_gazetteer_extractor_is_kept_when_the_templates_use_it():
+    model_settings = settings([(('iu', 0),), (('gaz', 0),)])
+    plan = plan_pipeline(model_settings)
+    assert plan.gazetteer
+    assert PlannedSettings(model_settings, plan).FEATURE_EXTRACTORS == model_settings.FEATURE_EXTRACTORS
@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import experiments_dir
+
+pytest.importorskip('estnltk')
+
+
+@pytest.fixture
+def preprocessing_protocols(monkeypatch):
+    # The data files of the modules are read relative to the experiments directory
+    monkeypatch.chdir(experiments_dir)
+    import modules.preprocessing_protocols as preprocessing_protocols
+    return preprocessing_protocols
+
+
+def test_memoised_vabamorf_is_accepted_by_vabamorf_tagger(preprocessing_protocols):
+    from estnltk.vabamorf.morf import Vabamorf
+    assert isinstance(preprocessing_protocols.memoised_vabamorf, Vabamorf)
+
+
+def test_preprocess_text_tags_a_short_text(preprocessing_protocols):
+    from estnltk import Text
+    text = Text('Mihkel Ambos kaebas Jaan Tamme peale. Kohus mõistis välja 3 rubla.')
+    preprocessing_protocols.preprocess_text(text, use_cache=False)
+    assert 'morph_analysis' in text.layers
+    assert len(text['morph_analysis']) == len(text['words'])
+
+    # A repeated sentence is analysed the same way from the cache
+    again = Text(text.text)
+    preprocessing_protocols.preprocess_text(again, use_cache=False)
+    assert [span.lemma for span in again['morph_analysis']] == [span.lemma for span in text['morph_analysis']]
+
+
+def test_memoised_vabamorf_analyses_words_in_their_context(preprocessing_protocols):
+    from estnltk.vabamorf.morf import Vabamorf
+    from modules.morph_memoisation import MemoisedVabamorf
+    vabamorf = Vabamorf.instance()
+    memoised = MemoisedVabamorf(vabamorf)
+    options = dict(disambiguate=False, guess=True, propername=True, compound=True, phonetic=False)
+    sentences = [['Kui', 'Jaan', 'tulli', ',', 'ütles', 'ta', ':', 'Kui', 'Mari', 'tulleb', '.'],
+                 ['1', ')', 'Astus', 'kohto', 'ette', 'Jaan', 'Tamm', '.'],
+                 ['Kohus', 'ütles', ':', 'Astus', 'Jaan', 'Tamm', 'ette', '?'],
+                 ['Kui', 'Jaan', 'tulli', ',', 'siis', 'kohus', 'Astus', '.']]
+    for sentence in sentences + sentences:
+        assert memoised.analyze(sentence, **options) == vabamorf.analyze(sentence, **options)
+    statistics = memoised.statistics()
+    assert statistics['hits'] >= sum(len(sentence) for sentence in sentences)
@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip('estnltk')
+
+from modules.template_compiler import compile_templates, join_values, sentence_attributes, text_attributes
+
+
+def test_compile_templates_names_and_context():
+    template, = compile_templates([(('lem', 0), ('lem', -1))])
+    assert template.name == 'lem[0]|lem[-1]'
+    assert template.fields == ('lem', 'lem')
+    assert (template.before, template.after) == (1, 0)
+    assert compile_templates([(('ending', 0),)])[0].name == 'end[0]'
+
+
+def test_compile_templates_rejects_malformed_and_unknown_templates():
+    with pytest.raises(ValueError):
+        compile_templates([()])
+    with pytest.raises(ValueError):
+        compile_templates([(('lem', '0'),)])
+    with pytest.raises(ValueError):
+        compile_templates([(('lemma', 0),)], attributes={'lem'})
+
+
+def test_compile_templates_deduplicates_only_when_asked():
+    templates = [(('au', -1),), [['au', -1]]]
+    assert len(compile_templates(templates, deduplicate=False)) == 2
+    assert len(compile_templates(templates, deduplicate=True)) == 1
+
+
+def test_join_values_as_apply_templates():
+    assert join_values(('jaan',)) == 'jaan'
+    assert join_values(('jaan', 'tamm')) == 'jaan|tamm'
+    assert join_values(('jaan', 'tamm', 'kask')) == 'jaan'
+    assert join_values(({'PER'},)) == 'PER'
+    assert join_values(({'PER'}, {'LOC'})) == 'PER|LOC'
+
+
+def test_templates_are_gathered_within_each_sentence():
+    templates = compile_templates([(('w', 0),), (('w', -1), ('w', 0)), (('iu', 1),)])
+    columns = {'w': ['Jaan', 'tuli', '.', 'Mart', 'läks'],
+               'iu': ['y', None, None, 'y', None]}
+    assert text_attributes(columns, [3, 2], templates) == [
+        ['w[0]=Jaan'],
+        ['w[0]=tuli', 'w[-1]|w[0]=Jaan|tuli'],
+        ['w[0]=.', 'w[-1]|w[0]=tuli|.'],
+        ['w[0]=Mart'],
+        ['w[0]=läks', 'w[-1]|w[0]=Mart|läks'],
+    ]
+    assert sentence_attributes({'w': columns['w'][3:], 'iu': columns['iu'][3:]}, 2, templates) == \
+        text_attributes(columns, [3, 2], templates)[3:]
+
+
+def test_gazetteer_labels_and_missing_fields():
+    templates = compile_templates([(('gaz', 0),), (('lem', 0),)])
+    columns = {'gaz': [{'PER'}, None]}
+    assert text_attributes(columns, [2], templates) == [['gaz[0]=PER'], []]
+    assert text_attributes(columns, [], templates) == []
@@ -0,0 +1,53 @@
+import re
+
+import pytest
+
+pytest.importorskip('estnltk')
+
+from estnltk import Text
+from estnltk.taggers import TokenSplitter
+
+from modules.token_splitting import GluedTokenSplitter, generic_pattern, read_token_splitter_rules
+
+texts = [
+    'Kohtumees Jaan ParkTõnisson ja maapeal elaw pereJaan tulid kohtopoolest.',
+    'Se on reppikäest wõetud, ütles mölderGottlieb ning talumeesNikolai.',
+    'Kohtowannem kohtowannemJaak ja kohtumeesA kirjutasid kohtupoolest ettepeaA.',
+    'pealmaapeal Oinasja teemaapeal',
+]
+
+
+# The TokenSplitter that GluedTokenSplitter replaces: the generic pattern and one pattern per rule
+def rule_token_splitter(rules):
+    patterns = [generic_pattern] + [re.compile('(?P<end>{}){}'.format(re.escape(first), re.escape(second)))
+                                    for first, second in rules]
+    return TokenSplitter(patterns=patterns)
+
+
+def token_spans(text_str, splitter):
+    text = Text(text_str)
+    text.tag_layer(['tokens'])
+    splitter.retag(text)
+    return [(span.start, span.end) for span in text.tokens]
+
+
+@pytest.mark.parametrize('text_str', texts)
+def test_same_tokens_as_token_splitter(text_str):
+    rules = read_token_splitter_rules()
+    assert token_spans(text_str, GluedTokenSplitter(rules)) == token_spans(text_str, rule_token_splitter(rules))
+
+
+def test_split_point_follows_the_rule_order():
+    splitter = GluedTokenSplitter([('maa', 'peal'), ('ma', 'apeal')])
+    assert splitter.split_point('maapeal') == 3
+    splitter = GluedTokenSplitter([('ma', 'apeal'), ('maa', 'peal')])
+    assert splitter.split_point('maapeal') == 2
+
+
+def test_split_point_without_a_match():
+    splitter = GluedTokenSplitter([('maa', 'peal')])
+    assert splitter.split_point('maa') is None
+    assert splitter.split_point('kohus') is None
+    # The generic pattern comes before the rules
+    assert splitter.split_point('JaanPark') == 4
+    assert GluedTokenSplitter([]).split_point('maapeal') is None